@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+agenda.py -- Udacity conference server-side Python App Engine
+    per-user agenda: the conferences a user attends & the sessions on
+    their wishlist, kept as one precomputed document
+
+$Id$
+
+The Agenda entity is a child of the user's Profile and holds the
+encoded AgendaForm. Registration and wishlist transactions edit it in
+the same transaction as the Profile (editAgenda()), and write it to
+memcache once they commit, so getAgenda() is normally one memcache get.
+Only those writers set the memcache entry; reads just add it, so they
+can't replace a newer agenda with the one they read.
+
+An Agenda that doesn't exist yet is built from the Profile on first
+read. Changes to a conference are fanned out to its attendees' agendas
+by the refresh_agendas task.
+"""
+
+from protorpc import protojson
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Agenda
+from models import AgendaForm
+from models import Profile
+from utils import addCoalescedTask
+
+import cache
+import converters
+
+MEMCACHE_AGENDA_KEY = "AGENDA: %s"
+CACHE_TIME = 60 * 60
+REFRESH_INTERVAL = 10
+REFRESH_BATCH = 50
+
+
+def agendaKey(p_key):
+    """Return the key of the profile's Agenda."""
+    return ndb.Key(Agenda, 'agenda', parent=p_key)
+
+
+def _cacheOnCommit(p_key, data):
+    """Put the encoded agenda in memcache once the transaction commits."""
+    cache_key = MEMCACHE_AGENDA_KEY % p_key.urlsafe()
+    ndb.get_context().call_on_commit(
+        lambda: memcache.set(cache_key, data, time=CACHE_TIME))
+
+
+def _sortForm(form):
+    """Order conferences by start date and sessions by date & time."""
+    form.conferences = sorted(form.conferences,
+                              key=lambda cf: (cf.startDate, cf.name))
+    form.sessions = sorted(form.sessions,
+                           key=lambda sf: (sf.date, sf.startTime, sf.name))
+    return form
+
+
+def editAgenda(agenda, add_conferences=(), remove_conference_keys=(),
+               add_sessions=(), remove_session_keys=()):
+    """Apply registration & wishlist changes to an Agenda fetched in the
+    transaction that changes its Profile.
+
+    Returns the Agenda to put along with the Profile, or None if the
+    user has no Agenda yet (getAgenda() builds it from the Profile).
+    """
+    if agenda is None:
+        return None
+    form = protojson.decode_message(AgendaForm, agenda.data)
+
+    dropped = set(key.urlsafe() for key in remove_conference_keys)
+    dropped.update(conf.key.urlsafe() for conf in add_conferences)
+    form.conferences = (
+        [cf for cf in form.conferences if cf.websafeKey not in dropped] +
+        [converters.conferenceToForm(conf) for conf in add_conferences])
+
+    dropped = set(key.urlsafe() for key in remove_session_keys)
+    dropped.update(sess.key.urlsafe() for sess in add_sessions)
+    form.sessions = (
+        [sf for sf in form.sessions if sf.websafeKey not in dropped] +
+        [converters.sessionToForm(sess) for sess in add_sessions])
+
+    agenda.data = protojson.encode_message(_sortForm(form))
+    _cacheOnCommit(agenda.key.parent(), agenda.data)
+    return agenda
+
+
+@ndb.transactional()
+def _storeAgenda(p_key, conf_keys, sess_keys, data):
+    """Store a rebuilt agenda unless the profile changed meanwhile."""
+    prof = p_key.get()
+    if (not prof or prof.conferenceKeysToAttend != conf_keys or
+            prof.sessWishlist != sess_keys):
+        return False
+    Agenda(key=agendaKey(p_key), data=data).put()
+    _cacheOnCommit(p_key, data)
+    return True
+
+
+def refreshAgenda(p_key, attempts=3):
+    """Rebuild the profile's agenda from its conferences & wishlist and
+    return it as an AgendaForm."""
+    form = AgendaForm()
+    for i in range(attempts):
+        prof = p_key.get(use_cache=False, use_memcache=False)
+        if not prof:
+            return form
+        conf_keys = prof.conferenceKeysToAttend
+        sess_keys = prof.sessWishlist
+        entities = cache.getEntities(conf_keys + sess_keys)
+        form = _sortForm(AgendaForm(
+            conferences=[converters.conferenceToForm(conf)
+                         for conf in entities[:len(conf_keys)] if conf],
+            sessions=[converters.sessionToForm(sess)
+                      for sess in entities[len(conf_keys):] if sess],
+        ))
+        if _storeAgenda(p_key, conf_keys, sess_keys,
+                        protojson.encode_message(form)):
+            break
+    return form
+
+
+def getAgenda(p_key):
+    """Return the profile's agenda as an AgendaForm."""
+    cache_key = MEMCACHE_AGENDA_KEY % p_key.urlsafe()
+    data = memcache.get(cache_key)
+    if data is None:
+        agenda = agendaKey(p_key).get()
+        if not agenda:
+            return refreshAgenda(p_key)
+        data = agenda.data
+        # add, not set: a newer agenda cached on commit meanwhile wins
+        memcache.add(cache_key, data, time=CACHE_TIME)
+    return protojson.decode_message(AgendaForm, data)
+
+
+def scheduleRefresh(conf_key):
+    """Queue a refresh_agendas task for the conference's attendees; all
+    changes within REFRESH_INTERVAL share one task."""
+    addCoalescedTask('refresh-agendas-%s' % conf_key.urlsafe(),
+                     '/tasks/refresh_agendas',
+                     {'websafeConferenceKey': conf_key.urlsafe()},
+                     REFRESH_INTERVAL)
+
+
+def refreshAgendas(websafeConferenceKey, websafeCursor=None):
+    """Rebuild the agendas of a batch of the conference's attendees;
+    queues itself for the next batch."""
+    conf_key = ndb.Key(urlsafe=websafeConferenceKey)
+    cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+    p_keys, next_cursor, more = Profile.query(
+        Profile.conferenceKeysToAttend == conf_key).fetch_page(
+            REFRESH_BATCH, start_cursor=cursor, keys_only=True)
+    for p_key in p_keys:
+        refreshAgenda(p_key)
+    if more and next_cursor:
+        taskqueue.add(params={'websafeConferenceKey': websafeConferenceKey,
+                              'cursor': next_cursor.urlsafe()},
+                      url='/tasks/refresh_agendas')
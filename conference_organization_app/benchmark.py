@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py -- Udacity conference server-side Python App Engine
+    per-request wall time of ConferenceApi handlers against the local
+    datastore, memcache & task queue stubs
+
+$Id$
+
+Run from this directory with the App Engine SDK on the Python path:
+
+    python benchmark.py [iterations]
+
+The handlers are timed on fresh stubs three times: as they are, with
+their independent reads overlapped; with every read waited on before
+the next one starts (sequentialFetches), the cache on in both runs so
+the difference is the overlap alone; and with the entity cache
+(cache.py) turned off. The stub RPCs have no network latency, so the
+overlap saves less here than it does in production. For latency
+percentiles & API call counts under many users, see loadtest.py.
+"""
+
+import contextlib
+import datetime
+import sys
+import time
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceForms
+from models import Profile
+from models import Session
+
+from loadtest import setUpTestbed
+
+import cache
+import conference
+
+ITERATIONS = 200
+LIST_SIZE = 10000
+
+
+def timeCalls(label, func, iterations):
+    """Call func() iterations times; print mean and median wall time."""
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        func(i)
+        timings.append((time.time() - start) * 1000)
+        # don't let ndb's in-context cache hide datastore reads
+        ndb.get_context().clear_cache()
+    timings.sort()
+    print '%-32s mean %7.2f ms   median %7.2f ms' % (
+        label, sum(timings) / len(timings), timings[len(timings) // 2])
+
+
+def allFieldsCopy(conf):
+    """Conference to ConferenceForm the way it was done per entity before
+    converters.py; the baseline for the list benchmark."""
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def benchmarkListResponse(api, iterations):
+    """Time building a LIST_SIZE conference list response, in memory."""
+    p_key = ndb.Key(Profile, 'bench@example.com')
+    confs = [Conference(key=ndb.Key(Conference, i + 1, parent=p_key),
+                        name='Conference %d' % i, city='London',
+                        topics=['Web', 'Programming Languages'],
+                        startDate=datetime.date(2016, 5, 1),
+                        endDate=datetime.date(2016, 5, 3), month=5,
+                        maxAttendees=100, seatsAvailable=100,
+                        organizerUserId='bench@example.com',
+                        organizerDisplayName='Bench')
+             for i in range(LIST_SIZE)]
+    label = '%d conference list' % LIST_SIZE
+    timeCalls(label + ' (all_fields)',
+        lambda i: ConferenceForms(items=[allFieldsCopy(c) for c in confs]),
+        iterations)
+    timeCalls(label + ' (converters)',
+        lambda i: ConferenceForms(items=[api._copyConferenceToForm(c) for c in confs]),
+        iterations)
+
+
+def _done(result):
+    """Return a future that already holds result."""
+    future = ndb.Future()
+    future.set_result(result)
+    return future
+
+
+@contextlib.contextmanager
+def sequentialFetches():
+    """Make the async reads and id allocations the handlers overlap wait
+    for their result before returning, as the handlers did before."""
+    getEntitiesAsync = cache.getEntitiesAsync
+    getEntityAsync = cache.getEntityAsync
+    getProfileAsync = conference.ConferenceApi._getProfileFromUserAsync
+    allocateIdsAsync = Session.allocate_ids_async
+    cache.getEntitiesAsync = lambda keys: _done(getEntitiesAsync(keys).get_result())
+    cache.getEntityAsync = lambda key: _done(getEntityAsync(key).get_result())
+    conference.ConferenceApi._getProfileFromUserAsync = \
+        lambda self: _done(getProfileAsync(self).get_result())
+    Session.allocate_ids_async = classmethod(
+        lambda cls, **kwargs: _done(allocateIdsAsync(**kwargs).get_result()))
+    try:
+        yield
+    finally:
+        cache.getEntitiesAsync = getEntitiesAsync
+        cache.getEntityAsync = getEntityAsync
+        conference.ConferenceApi._getProfileFromUserAsync = getProfileAsync
+        del Session.allocate_ids_async
+
+
+def benchmarkHandlers(iterations, label):
+    """Time the handlers on fresh stubs; label is appended to their names."""
+    tb = setUpTestbed()
+    api = conference.ConferenceApi()
+
+    api.createConference(ConferenceForm(name='Benchmark', maxAttendees=1000))
+    conf = conference.Conference.query().get()
+    wsck = conf.key.urlsafe()
+
+    session_request = conference.SESSION_POST_REQUEST.combined_message_class
+    timeCalls('createSession' + label,
+        lambda i: api.createSession(session_request(
+            websafeConferenceKey=wsck, name='Session %d' % i)),
+        iterations)
+
+    conf_request = conference.CONFERENCE_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+    timeCalls('register/unregister' + label,
+        lambda i: (api.registerForConference(conf_request),
+                   api.unregisterFromConference(conf_request)),
+        iterations)
+
+    wishlist_request = conference.WISHLIST_POST_REQUEST.combined_message_class
+    sess_keys = [key.urlsafe() for key in Session.query().fetch(keys_only=True)]
+
+    def addAndDelete(i):
+        request = wishlist_request(websafeSessionKey=sess_keys[i % len(sess_keys)])
+        api.addSessionToWishlist(request)
+        api.deleteSessionInWishlist(request)
+    timeCalls('wishlist add/delete' + label, addAndDelete, iterations)
+
+    tb.deactivate()
+
+
+def main(iterations):
+    benchmarkHandlers(iterations, ' (overlapped)')
+    with sequentialFetches():
+        benchmarkHandlers(iterations, ' (sequential)')
+    cache.ENABLED = False
+    try:
+        benchmarkHandlers(iterations, ' (no cache)')
+    finally:
+        cache.ENABLED = True
+
+    tb = setUpTestbed()
+    benchmarkListResponse(conference.ConferenceApi(), max(1, iterations // 20))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+cache.py -- Udacity conference server-side Python App Engine
+    memcache read-through cache for Conference, Session & Profile entities
+
+$Id$
+
+Entities are cached under their urlsafe key. Reads inside a transaction
+always go to the datastore; writers call invalidate() after put(), which
+defers the memcache delete until the transaction commits.
+
+Conference, Session and Profile turn off ndb's own memcache caching
+(_use_memcache), so this is the only memcache copy of them.
+
+A read-through only ever adds to memcache, and invalidate() locks the
+deleted keys against adds for LOCK_TIME, so a reader that fetched an
+entity just before a write can't put the old copy back in the cache.
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+MEMCACHE_ENTITY_KEY = "ENTITY: %s"
+MEMCACHE_STATS_KEY = "CACHE STATS: %s %s"
+CACHE_TIME = 60 * 60
+LOCK_TIME = 5
+# False sends every read straight to the datastore (see benchmark.py)
+ENABLED = True
+CACHED_KINDS = ('Conference', 'Session', 'Profile')
+
+
+def _toKey(key):
+    """Accept an ndb.Key or its urlsafe string."""
+    if isinstance(key, ndb.Key):
+        return key
+    return ndb.Key(urlsafe=key)
+
+
+def _statsOffsets(hits, misses):
+    """Return memcache counter offsets for per-kind hit/miss counts."""
+    offsets = {}
+    for kind, count in hits.items():
+        offsets[MEMCACHE_STATS_KEY % (kind, 'hits')] = count
+    for kind, count in misses.items():
+        offsets[MEMCACHE_STATS_KEY % (kind, 'misses')] = count
+    return offsets
+
+
+@ndb.tasklet
+def getEntitiesAsync(keys):
+    """Return a future for the entities of keys (or urlsafe strings), in
+    order, reading through memcache; missing entities come back as None.
+    """
+    keys = [_toKey(key) for key in keys]
+    if ndb.in_transaction() or not ENABLED:
+        # never serve a transaction from the cache
+        entities = yield ndb.get_multi_async(keys)
+        raise ndb.Return(entities)
+
+    ctx = ndb.get_context()
+    cache_keys = [MEMCACHE_ENTITY_KEY % key.urlsafe() for key in keys]
+    # the context batches these into a single memcache call
+    values = yield [ctx.memcache_get(cache_key) for cache_key in cache_keys]
+    cached = dict((cache_key, value) for cache_key, value
+                  in zip(cache_keys, values) if value is not None)
+
+    hits = {}
+    misses = {}
+    missing = []
+    for key, cache_key in zip(keys, cache_keys):
+        if cache_key in cached:
+            hits[key.kind()] = hits.get(key.kind(), 0) + 1
+        else:
+            misses[key.kind()] = misses.get(key.kind(), 0) + 1
+            missing.append(key)
+
+    if missing:
+        fetched = {}
+        entities = yield ndb.get_multi_async(missing)
+        for key, entity in zip(missing, entities):
+            if entity:
+                fetched[MEMCACHE_ENTITY_KEY % key.urlsafe()] = entity
+        # add, never set: an invalidate() since the get must win
+        yield [ctx.memcache_add(cache_key, entity, time=CACHE_TIME)
+               for cache_key, entity in fetched.items()]
+        cached.update(fetched)
+
+    if keys:
+        yield memcache.Client().offset_multi_async(
+            _statsOffsets(hits, misses), initial_value=0)
+    raise ndb.Return([cached.get(cache_key) for cache_key in cache_keys])
+
+
+def getEntities(keys):
+    """Return entities for keys (or urlsafe strings), in order, reading
+    through memcache; missing entities are returned as None.
+    """
+    return getEntitiesAsync(keys).get_result()
+
+
+@ndb.tasklet
+def getEntityAsync(key):
+    """Return a future for the entity of key (or urlsafe string)."""
+    entities = yield getEntitiesAsync([key])
+    raise ndb.Return(entities[0])
+
+
+def getEntity(key):
+    """Return entity for key (or urlsafe string) or None."""
+    return getEntityAsync(key).get_result()
+
+
+def invalidate(*keys):
+    """Drop cached copies of the given keys once the current transaction
+    (if any) commits; read-throughs can't re-add them for LOCK_TIME.
+    """
+    cache_keys = [MEMCACHE_ENTITY_KEY % _toKey(key).urlsafe() for key in keys]
+    ndb.get_context().call_on_commit(
+        lambda: memcache.delete_multi(cache_keys, seconds=LOCK_TIME))
+
+
+def getStats():
+    """Return {kind: {'hits': n, 'misses': n}} for the cached kinds."""
+    stats_keys = [MEMCACHE_STATS_KEY % (kind, counter)
+                  for kind in CACHED_KINDS for counter in ('hits', 'misses')]
+    counters = memcache.get_multi(stats_keys)
+    return dict((kind, {
+        'hits': counters.get(MEMCACHE_STATS_KEY % (kind, 'hits'), 0),
+        'misses': counters.get(MEMCACHE_STATS_KEY % (kind, 'misses'), 0),
+    }) for kind in CACHED_KINDS)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Test cases for cache.py
+#
+# Run from this directory with the App Engine SDK on the Python path:
+#
+#     python cache_test.py
+#
+# Every test runs against fresh local datastore & memcache stubs.
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Profile
+
+from loadtest import setUpTestbed
+
+import cache
+
+
+def newProfile(name='Ada'):
+    prof = Profile(key=ndb.Key(Profile, 'user@example.com'),
+                   displayName=name, mainEmail='user@example.com')
+    prof.put()
+    return prof
+
+def cached(key):
+    return memcache.get(cache.MEMCACHE_ENTITY_KEY % key.urlsafe())
+
+def testMiss():
+    prof = newProfile()
+    if cached(prof.key) is not None:
+        raise ValueError("A new profile shouldn't be cached.")
+    if cache.getEntity(prof.key).displayName != 'Ada':
+        raise ValueError("A miss should read the profile from the datastore.")
+    if cached(prof.key) is None:
+        raise ValueError("A miss should put the profile in memcache.")
+    if cache.getStats()['Profile']['misses'] != 1:
+        raise ValueError("The miss should be counted.")
+    print "1. A miss reads through to the datastore and fills memcache."
+
+def testHit():
+    prof = newProfile()
+    cache.getEntity(prof.key)
+    # change the datastore behind the cache's back
+    prof.displayName = 'Grace'
+    prof.put()
+    ndb.get_context().clear_cache()
+    if cache.getEntity(prof.key).displayName != 'Ada':
+        raise ValueError("A hit should be served from memcache.")
+    if cache.getStats()['Profile']['hits'] != 1:
+        raise ValueError("The hit should be counted.")
+    if cache.getEntities([prof.key, ndb.Key(Profile, 'nobody')])[1] is not None:
+        raise ValueError("A missing entity should come back as None.")
+    print "2. A hit is served from memcache."
+
+def testInvalidateOnCommit():
+    prof = newProfile()
+    cache.getEntity(prof.key)
+
+    @ndb.transactional()
+    def rename():
+        prof = Profile.get_by_id('user@example.com')
+        prof.displayName = 'Grace'
+        prof.put()
+        cache.invalidate(prof.key)
+        if cached(prof.key) is None:
+            raise ValueError("The cache should be kept until the commit.")
+        raise ndb.Rollback()
+    rename()
+    if cached(prof.key) is None:
+        raise ValueError("A rolled back transaction shouldn't invalidate.")
+
+    @ndb.transactional()
+    def renameAndCommit():
+        prof = Profile.get_by_id('user@example.com')
+        prof.displayName = 'Grace'
+        prof.put()
+        cache.invalidate(prof.key)
+    renameAndCommit()
+    if cached(prof.key) is not None:
+        raise ValueError("A commit should drop the cached profile.")
+    print "3. invalidate() drops the cached entity when the transaction commits."
+
+def testInvalidateRace():
+    prof = newProfile()
+    get_multi_async = ndb.get_multi_async
+
+    def getThenRename(keys, **kwargs):
+        # the reader fetched the old profile; a writer commits and
+        # invalidates before the reader gets to fill memcache
+        futures = get_multi_async(keys, **kwargs)
+        [future.get_result() for future in futures]
+        renamed = Profile.get_by_id('user@example.com', use_cache=False)
+        renamed.displayName = 'Grace'
+        renamed.put()
+        cache.invalidate(renamed.key)
+        return futures
+
+    ndb.get_multi_async = getThenRename
+    try:
+        stale = cache.getEntity(prof.key)
+    finally:
+        ndb.get_multi_async = get_multi_async
+    if stale.displayName != 'Ada':
+        raise ValueError("The reader should have fetched the old profile.")
+    if cached(prof.key) is not None:
+        raise ValueError("The old profile shouldn't be put back in memcache.")
+    ndb.get_context().clear_cache()
+    if cache.getEntity(prof.key).displayName != 'Grace':
+        raise ValueError("The next read should see the new profile.")
+    print "4. A read racing an invalidate() doesn't cache the old entity."
+
+if __name__ == '__main__':
+    for test in [testMiss, testHit, testInvalidateOnCommit, testInvalidateRace]:
+        tb = setUpTestbed()
+        try:
+            test()
+        finally:
+            tb.deactivate()
+    print "Success!  All tests pass!"
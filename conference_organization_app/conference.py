@@ -12,6 +12,7 @@ updated by Petros Kalogiannakis on 2016 feb 28
 
 __author__ = 'Wesley Chun, Petros Kalogiannakis'
 
+import random
 from datetime import datetime
 
 import endpoints
@@ -19,43 +20,74 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import PopularSessionForm
+from models import PopularSessionForms
 from models import StringMessage
 from models import BooleanMessage
 from models import Conference
+from models import NearlySoldOut
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceSummaryForm
+from models import ConferenceSummaryForms
 from models import ConferenceTopics
+from models import AgendaForm
+from models import AggregateForm
+from models import ExportReportForm
 from models import Session
 from models import SessionForm
 from models import SessionForms
 from models import SessionType
+from models import SpeakerTally
 from models import TeeShirtSize
+from models import WishlistConferenceForm
+from models import WishlistConferenceForms
+from models import WishlistUpdateForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
+from utils import addCoalescedTask
 from utils import getUserId
 
-from collections import Counter
+import agenda
+import cache
+import converters
+import export
+import mailer
+import planner
+import popularity
+import seats
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_FEATURED_KEY = "FEATURED SPEAKER: "
+FEATURED_SPEAKER_INTERVAL = 10
+FEATURED_SPEAKER_MIN_SESSIONS = 2
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+NEARLY_SOLD_OUT_SEATS = 5
+NEARLY_SOLD_OUT_KEY = ndb.Key(NearlySoldOut, 'announcement')
+DEFAULT_PAGE_SIZE = 20
+MAX_WISHLIST_SESSIONS = 100
+MAX_BATCH_SIZE = 400
+MAX_PAGE_SIZE = 100
+DEFAULT_POPULAR_SESSIONS = 10
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -92,11 +124,45 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+# Conference fields with a composite index, most selective first; the
+# query planner sends one filter on these to the datastore
+INDEXED_FIELDS = ['city', 'month', 'topics', 'maxAttendees']
+
+# Session equality filters with a composite index (ending in startTime),
+# most selective first; searchSessions sends one of these to the datastore
+SESSION_INDEXED_COMBINATIONS = [
+    ('speaker',),
+    ('month', 'typeOfSession'),
+    ('month', 'notTypeOfSession'),
+    ('month',),
+    ('typeOfSession',),
+    ('notTypeOfSession',),
+]
+
+# composite indexes the handlers rely on; `python planner.py > index.yaml`
+INDEXES = [
+    ('Conference', ['city', 'name']),
+    ('Conference', ['month', 'name']),
+    ('Conference', ['topics', 'name']),
+    ('Conference', ['maxAttendees', 'name']),
+    # getConferenceSummaries projection
+    ('Conference', ['city', 'month', 'name']),
+    # _cacheAnnouncement projection (seatsAvailable inequality)
+    ('Conference', ['seatsAvailable', 'name']),
+] + [('Session', list(combination) + ['startTime'])
+     for combination in SESSION_INDEXED_COMBINATIONS]
+
 CONFERENCE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    limit=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -110,16 +176,34 @@ FEATURED_REQUEST = endpoints.ResourceContainer(
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    limit=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
 )
 
 SESSION_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     typeOfSession=messages.EnumField(SessionType, 1),
     websafeConferenceKey=messages.StringField(2),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4),
 )
 
 SESSION_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     speaker=messages.StringField(1),
     websafeConferenceKey=messages.StringField(2),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4),
+)
+
+SESSION_SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    typeOfSession=messages.EnumField(SessionType, 1),
+    excludeTypeOfSession=messages.EnumField(SessionType, 2, repeated=True),
+    speaker=messages.StringField(3),
+    month=messages.IntegerField(4, variant=messages.Variant.INT32),
+    startAfter=messages.StringField(5),
+    startBefore=messages.StringField(6),
+    limit=messages.IntegerField(7, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(8),
 )
 
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
@@ -127,6 +211,17 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+POPULAR_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    limit=messages.IntegerField(2, variant=messages.Variant.INT32),
+)
+
 WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1)
@@ -138,11 +233,15 @@ WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
 )
 
 CONF_TOPIC_REQUEST = endpoints.ResourceContainer(
-    topics=messages.EnumField(ConferenceTopics, 1)
+    topics=messages.EnumField(ConferenceTopics, 1),
+    limit=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
 )
 
 CONF_CITY_REQUEST = endpoints.ResourceContainer(
-    city=messages.StringField(1)
+    city=messages.StringField(1),
+    limit=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
 )
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -155,31 +254,22 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
-
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        return converters.conferenceToForm(conf)
+
+    def _copyConferenceSummaryToForm(self, conf):
+        """Copy projected fields from Conference to ConferenceSummaryForm."""
+        return ConferenceSummaryForm(
+            name=conf.name,
+            city=conf.city,
+            month=conf.month,
+            websafeKey=conf.key.urlsafe(),
+        )
 
+    def _conferenceFromForm(self, request, user_id, prof):
+        """Build a Conference (without key) from a ConferenceForm; defaults
+        are filled in on the form too."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
@@ -206,21 +296,31 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        data['organizerUserId'] = request.organizerUserId = user_id
+        # store the organizer's name so listings don't need the Profile
+        data['organizerDisplayName'] = request.organizerDisplayName = prof.displayName
+        return Conference(**data)
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        prof = self._getProfileFromUser()
+
+        conf = self._conferenceFromForm(request, user_id, prof)
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
-        p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        conference_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = conference_key
-        data['organizerUserId'] = request.organizerUserId = user_id
+        c_id = Conference.allocate_ids(size=1, parent=prof.key)[0]
+        conf.key = ndb.Key(Conference, c_id, parent=prof.key)
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        conf.put()
+        mailer.queueConfirmationEmails(user.email(),
+                                       [(conf.key.urlsafe(), repr(request))])
         return request
 
     @ndb.transactional()
@@ -230,11 +330,16 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        conf = self._saveConferenceUpdate(
+            ndb.Key(urlsafe=request.websafeConferenceKey), request, user_id)
+        return self._copyConferenceToForm(conf)
 
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+    @ndb.transactional(xg=True)
+    def _saveConferenceUpdate(self, conf_key, request, user_id):
+        """Copy the fields of the request onto the conference and, once
+        registration has opened, its seat shards, in one transaction.
+        """
+        conf = conf_key.get()
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
@@ -248,6 +353,12 @@ class ConferenceApi(remote.Service):
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # organizer fields are owned by the server
+            if field.name in ('organizerUserId', 'organizerDisplayName'):
+                continue
+            # once registration has opened the seat shards own the seats
+            if field.name in ('maxAttendees', 'seatsAvailable') and conf.seatShards:
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -258,9 +369,23 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        if conf.seatShards:
+            max_attendees = request.maxAttendees
+            if max_attendees is None:
+                max_attendees = conf.maxAttendees or 0
+            try:
+                seats_left = seats.resizeShards(conf, max_attendees)
+            except ValueError as e:
+                raise endpoints.BadRequestException(str(e))
+            if request.seatsAvailable not in (None, seats_left):
+                raise endpoints.BadRequestException(
+                    "seatsAvailable can't be set once registration has "
+                    "opened; change maxAttendees instead")
+
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cache.invalidate(conf.key)
+        return conf
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
@@ -268,12 +393,48 @@ class ConferenceApi(remote.Service):
         """Create new conference."""
         return self._createConferenceObject(request)
 
+    @endpoints.method(ConferenceForms, ConferenceForms, path='conferences',
+            http_method='POST', name='createConferences')
+    def createConferences(self, request):
+        """Create many conferences at once."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        prof = self._getProfileFromUser()
+        self._checkBatchSize(request.items)
+
+        confs = [self._conferenceFromForm(form, user_id, prof) for form in request.items]
+        # one id allocation, one put and one task queue call per 100 emails
+        first, last = Conference.allocate_ids(size=len(confs), parent=prof.key)
+        for c_id, conf in zip(range(first, last + 1), confs):
+            conf.key = ndb.Key(Conference, c_id, parent=prof.key)
+        ndb.put_multi(confs)
+        mailer.queueConfirmationEmails(user.email(),
+            [(conf.key.urlsafe(), repr(form))
+             for conf, form in zip(confs, request.items)])
+
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf) for conf in confs]
+        )
+
+    def _checkBatchSize(self, items):
+        """Reject empty batches and batches too big for one commit."""
+        if not items:
+            raise endpoints.BadRequestException("'items' field required")
+        if len(items) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                "At most %d items can be created at once" % MAX_BATCH_SIZE)
+
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        cf = self._updateConferenceObject(request)
+        # attendees' agendas hold a copy of the conference
+        agenda.scheduleRefresh(ndb.Key(urlsafe=request.websafeConferenceKey))
+        return cf
 
     @endpoints.method(CONFERENCE_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
@@ -281,19 +442,18 @@ class ConferenceApi(remote.Service):
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = cache.getEntity(request.websafeConferenceKey)
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferenceToForm(conf)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
-        """Return conferences created by user."""
+        """Return a page of the conferences created by user."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -301,36 +461,99 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        q = Conference.query(ancestor=ndb.Key(Profile, user_id))
+        confs, next_token = self._getConferencesByKeys(q, request)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[self._copyConferenceToForm(conf) for conf in confs],
+            nextPageToken=next_token
         )
 
+    def _fetchPage(self, query, request, filters=None, **options):
+        """Fetch one page of query results; return (results, nextPageToken).
+
+        The page size comes from request.limit and the starting position
+        from request.pageToken, a websafe cursor returned by a previous call.
+        Results must also pass the in-memory filters, if any. Extra query
+        options (projection, keys_only) are passed to fetch_page.
+        """
+        limit = request.limit or DEFAULT_PAGE_SIZE
+        if limit < 1:
+            raise endpoints.BadRequestException("'limit' must be positive")
+        limit = min(limit, MAX_PAGE_SIZE)
+
+        try:
+            cursor = Cursor(urlsafe=request.pageToken) if request.pageToken else None
+            if filters:
+                results, next_cursor, more = planner.fetchPage(
+                    query, filters, limit, start_cursor=cursor)
+            else:
+                results, next_cursor, more = query.fetch_page(
+                    limit, start_cursor=cursor, **options)
+        except (datastore_errors.BadValueError, datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        return results, next_token
+
+    def _pageOfKeys(self, keys, request):
+        """Return (keys of one page, nextPageToken) of a list of keys.
+
+        Like _fetchPage, but for the key lists stored on the Profile; the
+        pageToken is the position of the first key of the page.
+        """
+        limit = request.limit or DEFAULT_PAGE_SIZE
+        if limit < 1:
+            raise endpoints.BadRequestException("'limit' must be positive")
+        limit = min(limit, MAX_PAGE_SIZE)
+
+        try:
+            start = int(request.pageToken) if request.pageToken else 0
+        except ValueError:
+            start = -1
+        if start < 0:
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+
+        end = start + limit
+        next_token = str(end) if end < len(keys) else None
+        return keys[start:end], next_token
+
+    def _getConferencesByKeys(self, query, request):
+        """Fetch a page of conferences with a keys-only query.
+
+        Keys-only queries are billed as small operations; the entities
+        are then read through the memcache entity cache.
+        """
+        keys, next_token = self._fetchPage(query, request, keys_only=True)
+        conferences = [conf for conf in cache.getEntities(keys) if conf]
+        return conferences, next_token
+
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+        """Return (query, in-memory filters) for the submitted filters."""
+        return self._plannedQuery(self._formatFilters(request.filters))
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+    def _plannedQuery(self, filters):
+        """Return (query, in-memory filters) for formatted filters.
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+        Only the most selective indexed filter goes to the datastore, so
+        any combination of filters is served by the INDEXES; the others
+        are applied in memory while paging.
+        """
+        index_filter, residual = planner.planFilters(filters, INDEXED_FIELDS)
+
+        q = Conference.query()
+        if index_filter:
+            q = q.filter(ndb.query.FilterNode(index_filter["field"],
+                index_filter["operator"], index_filter["value"]))
+            # an inequality filter needs its property sorted first
+            if index_filter["operator"] != "=":
+                q = q.order(ndb.GenericProperty(index_filter["field"]))
+        q = q.order(Conference.name)
+        return q, residual
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -341,18 +564,15 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s needs a number." % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
@@ -360,53 +580,40 @@ class ConferenceApi(remote.Service):
             name='queryConferences')
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        query, filters = self._getQuery(request)
+        conferences, next_token = self._fetchPage(query, request, filters)
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+                items=[self._copyConferenceToForm(conf) for conf in conferences],
+                nextPageToken=next_token
+        )
+
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceSummaryForms,
+            path='conferences/summary',
+            http_method='GET',
+            name='getConferenceSummaries')
+    def getConferenceSummaries(self, request):
+        """Return name, city and month of conferences, ordered by city."""
+        # projection served entirely from the (city, month, name) index;
+        # city and month are always set, so no conference is left out
+        q = Conference.query().order(
+            Conference.city, Conference.month, Conference.name)
+        conferences, next_token = self._fetchPage(q, request,
+            projection=[Conference.city, Conference.month, Conference.name])
+        return ConferenceSummaryForms(
+            items=[self._copyConferenceSummaryToForm(conf) for conf in conferences],
+            nextPageToken=next_token
         )
 
 # - - - Sessions - - -  - - - - - - - - - - - - - - - - - - -
 
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-                if field.name == 'typeOfSession':
-                    setattr(sf, field.name, getattr(SessionType, getattr(
-                        sess, field.name)))
-                elif field.name == 'date':
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                elif field.name.endswith('Time'):
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                elif field.name == 'duration':
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                elif field.name == 'speaker':
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, sess.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return converters.sessionToForm(sess)
 
-    def _createSessionObject(self, request):
-        """Create or update Session object, returning SessionForm/request."""
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        conference_key = conf.key
+    def _checkConferenceOwner(self, conf, websafeConferenceKey):
+        """Make sure the user is logged in and organizes the conference."""
         # Check if user is logged in
         user = endpoints.get_current_user()
         if not user:
@@ -414,13 +621,16 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+                'No conference found with key: %s' % websafeConferenceKey)
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'The conference can only be updated by the owner.')
 
+    def _sessionFromForm(self, request):
+        """Build a Session (without key) from a SessionForm; defaults are
+        filled in on the form too."""
         # Copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        data = {field.name: getattr(request, field.name) for field in SessionForm.all_fields()}
 
         # Add default values if values are missing
         for df in DEFAULTS_SESSION:
@@ -441,24 +651,86 @@ class ConferenceApi(remote.Service):
             data['speaker'] = str(data['speaker'])
 
         # Delete websfCnf Keys
-        del data['websafeConferenceKey']
         del data['websafeKey']
         del data['websafeCnfKey']
+        return Session(**data)
 
-        s_id = Session.allocate_ids(size=1, parent=conference_key)[0]
-        s_key = ndb.Key(Session, s_id, parent=conference_key)
-        data['key'] = s_key
-        # Create Session
-        Session(**data).put()
-        # Add task to taskqueue
-        taskqueue.add(params={'websafeConferenceKey': request.websafeConferenceKey},
-            url='/tasks/featured_speaker'
-        )
-        # For use in SessionForm
-        sess = s_key.get()
+    def _createSessionObject(self, request):
+        """Create or update Session object, returning SessionForm/request."""
+        # Fetch the conference and allocate the session id in parallel
+        conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf_future = cache.getEntityAsync(conference_key)
+        s_ids_future = Session.allocate_ids_async(size=1, parent=conference_key)
+        self._checkConferenceOwner(conf_future.get_result(),
+                                   request.websafeConferenceKey)
+
+        sess = self._sessionFromForm(request)
+        s_id = s_ids_future.get_result()[0]
+        sess.key = ndb.Key(Session, s_id, parent=conference_key)
+        # Create Session and count its speaker
+        self._putSessions(conference_key, [sess])
+        # Add (coalesced) task to taskqueue
+        self._scheduleFeaturedSpeaker(conference_key)
 
         return self._copySessionToForm(sess)
 
+    def _createSessionObjects(self, request):
+        """Create many Sessions of a conference, returning SessionForms."""
+        self._checkBatchSize(request.items)
+        # Fetch the conference and allocate all session ids in parallel
+        conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf_future = cache.getEntityAsync(conference_key)
+        s_ids_future = Session.allocate_ids_async(
+            size=len(request.items), parent=conference_key)
+        self._checkConferenceOwner(conf_future.get_result(),
+                                   request.websafeConferenceKey)
+
+        sessions = [self._sessionFromForm(form) for form in request.items]
+        first, last = s_ids_future.get_result()
+        for s_id, sess in zip(range(first, last + 1), sessions):
+            sess.key = ndb.Key(Session, s_id, parent=conference_key)
+        # One transaction stores all sessions and counts their speakers
+        self._putSessions(conference_key, sessions)
+        self._scheduleFeaturedSpeaker(conference_key)
+
+        return SessionForms(
+            items=[self._copySessionToForm(sess) for sess in sessions]
+        )
+
+    @ndb.transactional()
+    def _putSessions(self, conference_key, sessions):
+        """Store sessions of a conference and add their speakers to the
+        conference's SpeakerTally, in one transaction.
+        """
+        tally_key = ndb.Key(SpeakerTally, 1, parent=conference_key)
+        tally = tally_key.get()
+        if not tally:
+            # first tally for this conference; count the existing sessions
+            tally = SpeakerTally(key=tally_key, counts={})
+            self._tallySpeakers(tally, Session.query(ancestor=conference_key))
+
+        self._tallySpeakers(tally, sessions)
+        ndb.put_multi(sessions + [tally])
+
+    @staticmethod
+    def _tallySpeakers(tally, sessions):
+        """Add sessions to the tally, keeping track of the top speaker."""
+        for sess in sessions:
+            if not sess.speaker:
+                continue
+            count = tally.counts.get(sess.speaker, 0) + 1
+            tally.counts[sess.speaker] = count
+            if count > tally.featuredCount:
+                tally.featuredSpeaker = sess.speaker
+                tally.featuredCount = count
+
+    @staticmethod
+    def _scheduleFeaturedSpeaker(conference_key):
+        """Queue the featured_speaker task, once per interval per conference."""
+        wsck = conference_key.urlsafe()
+        addCoalescedTask('featured-speaker-%s' % wsck, '/tasks/featured_speaker',
+                         {'websafeConferenceKey': wsck}, FEATURED_SPEAKER_INTERVAL)
+
     @endpoints.method(SESSION_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/sessions',
             http_method='GET',
@@ -466,17 +738,18 @@ class ConferenceApi(remote.Service):
     def getConferenceSessions(self, request):
         """Given a conference, return all sessions"""
         # Convert websafeKey to conference key
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        conference_key = conf.key
+        conf = cache.getEntity(request.websafeConferenceKey)
         # Check if conference exists
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s'
                 % request.websafeConferenceKey)
 
-        sessions = Session.query(ancestor=conference_key)
+        sessions, next_token = self._fetchPage(
+            Session.query(ancestor=conf.key), request)
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
+            items=[self._copySessionToForm(sess) for sess in sessions],
+            nextPageToken=next_token
         )
 
     @endpoints.method(SESSION_TYPE_GET_REQUEST, SessionForms,
@@ -486,19 +759,20 @@ class ConferenceApi(remote.Service):
     def getConferenceSessionsByType(self, request):
         """Given a conference, return all sessions of a specified type (eg lecture, keynote, workshop)"""
         # Convert websafeKey to conference key
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        conference_key = conf.key
+        conf = cache.getEntity(request.websafeConferenceKey)
         # Check if conference exists
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s'
                 % request.websafeConferenceKey)
 
-        sessions = Session.query(ancestor=conference_key)
+        sessions = Session.query(ancestor=conf.key)
         # Filter by typeOfSession
         sessions = sessions.filter(Session.typeOfSession == str(request.typeOfSession))
+        sessions, next_token = self._fetchPage(sessions, request)
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
+            items=[self._copySessionToForm(sess) for sess in sessions],
+            nextPageToken=next_token
         )
 
     @endpoints.method(SESSION_SPEAKER_GET_REQUEST, SessionForms,
@@ -508,21 +782,86 @@ class ConferenceApi(remote.Service):
     def getSessionsBySpeaker(self, request):
         """Given a speaker return all sessions given by this particular speaker, across all conferences"""
         # Convert websafeKey to conference key
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        conference_key = conf.key
+        conf = cache.getEntity(request.websafeConferenceKey)
         # Check if conference exists
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s'
                 % request.websafeConferenceKey)
 
-        sessions = Session.query(ancestor=conference_key)
+        sessions = Session.query(ancestor=conf.key)
         # Filter by typeOfSession
         sessions = sessions.filter(Session.speaker == str(request.speaker))
+        sessions, next_token = self._fetchPage(sessions, request)
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
+            items=[self._copySessionToForm(sess) for sess in sessions],
+            nextPageToken=next_token
+        )
+
+    def _formatSessionFilters(self, request):
+        """Turn searchSessions parameters into planner filters."""
+        filters = []
+        if request.typeOfSession:
+            filters.append({"field": "typeOfSession", "operator": "=",
+                            "value": str(request.typeOfSession)})
+        for excluded in request.excludeTypeOfSession:
+            filters.append({"field": "notTypeOfSession", "operator": "=",
+                            "value": str(excluded)})
+        if request.speaker:
+            filters.append({"field": "speaker", "operator": "=",
+                            "value": request.speaker})
+        if request.month:
+            filters.append({"field": "month", "operator": "=",
+                            "value": request.month})
+        for param, operator in (('startAfter', '>='), ('startBefore', '<')):
+            value = getattr(request, param)
+            if value:
+                try:
+                    value = datetime.strptime(value[:5], "%H:%M").time()
+                except ValueError:
+                    raise endpoints.BadRequestException(
+                        "'%s' must be given as HH:MM" % param)
+                filters.append({"field": "startTime", "operator": operator,
+                                "value": value})
+        return filters
+
+    @endpoints.method(SESSION_SEARCH_REQUEST, SessionForms,
+            path='sessions/search',
+            http_method='GET',
+            name='searchSessions')
+    def searchSessions(self, request):
+        """Search sessions across all conferences by type (or excluded
+        types), speaker, month and start time window"""
+        filters = self._formatSessionFilters(request)
+        datastore_filters, residual = planner.planCombination(
+            filters, SESSION_INDEXED_COMBINATIONS, 'startTime')
+
+        q = Session.query()
+        for f in datastore_filters:
+            prop = getattr(Session, f["field"])
+            q = q.filter(planner.PREDICATES[f["operator"]](prop, f["value"]))
+        q = q.order(Session.startTime)
+
+        sessions, next_token = self._fetchPage(q, request, residual)
+        return SessionForms(
+            items=[self._copySessionToForm(sess) for sess in sessions],
+            nextPageToken=next_token
         )
 
+    @staticmethod
+    def _backfillSessionSearchFields(websafeCursor=None):
+        """Re-put a batch of sessions so _pre_put_hook fills in the
+        search fields; queues itself for the next batch."""
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        sessions, next_cursor, more = Session.query().fetch_page(
+            100, start_cursor=cursor)
+        ndb.put_multi(sessions)
+        cache.invalidate(*[sess.key for sess in sessions])
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/backfill_sessions'
+            )
+
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
             path='conference/{websafeConferenceKey}/sessions',
             http_method='POST',
@@ -531,44 +870,159 @@ class ConferenceApi(remote.Service):
         """Open only to the organizer of the conference"""
         return self._createSessionObject(request)
 
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms,
+            path='conference/{websafeConferenceKey}/sessions/batch',
+            http_method='POST',
+            name='createSessions')
+    def createSessions(self, request):
+        """Create many sessions at once; open only to the organizer of the conference"""
+        return self._createSessionObjects(request)
+
 # - - - Wishlist (Task 2) - - - - - - - - - - - - - - - - - - -
 
+    def _sessionKey(self, websafeSessionKey):
+        """Convert a websafe session key to an ndb.Key, checking its kind."""
+        try:
+            s_key = ndb.Key(urlsafe=websafeSessionKey)
+        except Exception:
+            s_key = None
+        if not s_key or s_key.kind() != 'Session':
+            raise endpoints.BadRequestException(
+                'Invalid session key: %s' % websafeSessionKey)
+        return s_key
+
+    @ndb.transactional
+    def _updateWishlist(self, p_key, add_sessions=(), remove_keys=(), strict=False):
+        """Add and remove sessions of the profile's wishlist.
+
+        The transaction only covers the profile's entity group, which
+        holds the user's Agenda too. With strict, adding a session that
+        is already there or removing one that isn't raises
+        ConflictException. The interest counts of the sessions are
+        updated by a task queued in the same transaction. Returns the
+        profile with the keys that were actually added & removed.
+        """
+        prof, user_agenda = ndb.get_multi([p_key, agenda.agendaKey(p_key)])
+        # a session listed twice is added once, keeping the order
+        seen = set()
+        unique = []
+        for sess in add_sessions:
+            if sess.key not in seen:
+                seen.add(sess.key)
+                unique.append(sess)
+        add_sessions = unique
+        add_keys = [sess.key for sess in add_sessions]
+        remove_keys = set(remove_keys)
+        wishlist = set(prof.sessWishlist)
+
+        if strict and wishlist.intersection(add_keys):
+            raise ConflictException(
+                "This session is already on your wishlist")
+        if strict and not remove_keys.issubset(wishlist):
+            raise ConflictException(
+                "The session doesn't exist")
+
+        kept = [key for key in prof.sessWishlist if key not in remove_keys]
+        added = [key for key in add_keys if key not in wishlist]
+        if len(kept) + len(added) > MAX_WISHLIST_SESSIONS:
+            raise ConflictException(
+                "A wishlist can hold at most %d sessions" % MAX_WISHLIST_SESSIONS)
+
+        prof.sessWishlist = kept + added
+        user_agenda = agenda.editAgenda(user_agenda,
+            add_sessions=[sess for sess in add_sessions if sess.key not in wishlist],
+            remove_session_keys=remove_keys)
+        ndb.put_multi([entity for entity in (prof, user_agenda) if entity])
+        cache.invalidate(prof.key)
+        removed = [key for key in remove_keys if key in wishlist]
+        popularity.queueCount(added, removed)
+        return prof, added, removed
+
     @endpoints.method(WISHLIST_POST_REQUEST, BooleanMessage,
             path='addWishlist',
             http_method='POST',
             name='addSessionToWishlist')
-    @ndb.transactional
     def addSessionToWishlist(self, request):
         """Adds the session to the user's wishlist"""
         exists = None
+        sess_key = self._sessionKey(request.websafeSessionKey)
+        # Fetch the profile and the session in parallel
+        prof_future = self._getProfileFromUserAsync()
+        sess_future = cache.getEntityAsync(sess_key)
+        prof = prof_future.get_result()
         # Check if session exists (using the key)
-        sess = ndb.Key(urlsafe=request.websafeSessionKey).get()
+        sess = sess_future.get_result()
         if not sess:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % request.websafeSessionKey)
 
-        prof = self._getProfileFromUser()
-        # Raise exception if session is already in the wishlist
-        if request.websafeSessionKey in prof.sessWishlist:
-            raise ConflictException(
-                "This session is already on your wishlist")
-
-        prof.sessWishlist.append(request.websafeSessionKey)
-        prof.put()
+        self._updateWishlist(prof.key, add_sessions=[sess], strict=True)
         exists = True
         return BooleanMessage(data=exists)
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(CONF_LIST_REQUEST, SessionForms,
             path='getWishlist',
             http_method='GET',
             name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
-        """Query for all the sessions in a conference that the user is interested in"""
+        """Query for a page of the sessions that the user is interested in"""
         prof = self._getProfileFromUser()
-        session_keys = [ndb.Key(urlsafe=wish_sess) for wish_sess in prof.sessWishlist]
-        # Get all sessions at once
-        sessions = ndb.get_multi(session_keys)
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+        # Get all sessions of the page at once
+        keys, next_token = self._pageOfKeys(prof.sessWishlist, request)
+        sessions = cache.getEntities(keys)
+        return SessionForms(items=[self._copySessionToForm(session)
+                                   for session in sessions if session],
+                            nextPageToken=next_token)
+
+    @endpoints.method(message_types.VoidMessage, WishlistConferenceForms,
+            path='getWishlistByConference',
+            http_method='GET',
+            name='getWishlistByConference')
+    def getWishlistByConference(self, request):
+        """Return the sessions in the user's wishlist grouped by conference"""
+        prof = self._getProfileFromUser()
+        # Sessions and their conferences in one batch
+        conf_keys = []
+        seen = set()
+        for sess_key in prof.sessWishlist:
+            if sess_key.parent() not in seen:
+                seen.add(sess_key.parent())
+                conf_keys.append(sess_key.parent())
+        entities = cache.getEntities(prof.sessWishlist + conf_keys)
+        sessions = entities[:len(prof.sessWishlist)]
+        conferences = entities[len(prof.sessWishlist):]
+
+        grouped = dict((conf_key, []) for conf_key in conf_keys)
+        for sess in sessions:
+            if sess:
+                grouped[sess.key.parent()].append(self._copySessionToForm(sess))
+
+        return WishlistConferenceForms(items=[
+            WishlistConferenceForm(
+                conference=self._copyConferenceToForm(conf),
+                sessions=grouped[conf.key])
+            for conf in conferences if conf and grouped[conf.key]])
+
+    @endpoints.method(WishlistUpdateForm, ProfileForm,
+            path='updateWishlist',
+            http_method='POST',
+            name='updateWishlist')
+    def updateWishlist(self, request):
+        """Add and remove many sessions of the user's wishlist at once"""
+        add_keys = [self._sessionKey(wssk) for wssk in request.add]
+        remove_keys = [self._sessionKey(wssk) for wssk in request.remove]
+
+        # Check that the added sessions exist, outside the transaction
+        prof_future = self._getProfileFromUserAsync()
+        sessions = cache.getEntities(add_keys)
+        for wssk, sess in zip(request.add, sessions):
+            if not sess:
+                raise endpoints.NotFoundException(
+                    'No session found with key: %s' % wssk)
+
+        prof = prof_future.get_result()
+        prof, added, removed = self._updateWishlist(prof.key, sessions, remove_keys)
+        return self._copyProfileToForm(prof)
 
     @endpoints.method(WISHLIST_POST_REQUEST, BooleanMessage,
             path='deleteWishlist',
@@ -577,23 +1031,25 @@ class ConferenceApi(remote.Service):
     def deleteSessionInWishlist(self, request):
         """Removes the session from the users list of sessions they are interested in attending"""
         exists = None
-        prof = self._getProfileFromUser()
-        # Get the session and its keys
-        sess = ndb.Key(urlsafe=request.websafeSessionKey).get()
-        conf_key = sess.key.parent().urlsafe()
+        # The conference key is the session key's parent, so the profile,
+        # the session and its conference can all be fetched at once
+        sess_key = self._sessionKey(request.websafeSessionKey)
+        prof_future = self._getProfileFromUserAsync()
+        sess_future = cache.getEntityAsync(sess_key)
+        conf_future = cache.getEntityAsync(sess_key.parent())
+
+        prof = prof_future.get_result()
+        if not sess_future.get_result():
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeSessionKey)
         # Raise exception if conference not found
-        conf = ndb.Key(urlsafe=conf_key).get()
+        conf = conf_future.get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with session key: %s' % request.websafeSessionKey)
 
-        if not request.websafeSessionKey in prof.sessWishlist:
-            raise ConflictException(
-                "The session doesn't exist")
-        else:
-            prof.sessWishlist.remove(request.websafeSessionKey)
-            prof.put()
-            exists = True
+        self._updateWishlist(prof.key, remove_keys=[sess_key], strict=True)
+        exists = True
 
         return BooleanMessage(data=exists)
 
@@ -612,9 +1068,11 @@ class ConferenceApi(remote.Service):
 
         # Get all conferences filtered by their topic and ordered by name
         conferences_by_topic = Conference.query().filter(Conference.topics == str(request.topics)).order(Conference.name)
+        conferences, next_token = self._getConferencesByKeys(conferences_by_topic, request)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in conferences_by_topic]
+            items=[self._copyConferenceToForm(conf) for conf in conferences],
+            nextPageToken=next_token
         )
 
     @endpoints.method(CONF_CITY_REQUEST, ConferenceForms,
@@ -630,83 +1088,72 @@ class ConferenceApi(remote.Service):
 
         # Get all conferences filtered by their city and ordered by name
         conferences_in_city = Conference.query().filter(Conference.city == request.city).order(Conference.name)
+        conferences, next_token = self._getConferencesByKeys(conferences_in_city, request)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in conferences_in_city]
+            items=[self._copyConferenceToForm(conf) for conf in conferences],
+            nextPageToken=next_token
         )
 
 # - - - Task 4 - - - - - - - - - - - - - - - - - - -
     @staticmethod
     def _cacheFeaturedSpeaker(websafeConferenceKey):
-        """Check if a speaker is a featured speaker"""
-        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException('No conference found with key: %s' % websafeConferenceKey)
-
-        # Empty array
-        speaker_list = []
-        session = Session.query(ancestor=ndb.Key(urlsafe=websafeConferenceKey))
-        sess = session.fetch()
+        """Set the conference's featured speaker in memcache; a speaker
+        with at least FEATURED_SPEAKER_MIN_SESSIONS sessions is featured.
+        """
+        conf_key = ndb.Key(urlsafe=websafeConferenceKey)
+        tally = ndb.Key(SpeakerTally, 1, parent=conf_key).get()
 
-        speaker = None
         featured = None
-        for spkr in sess:
-            if spkr.speaker:
-                speaker_list.append(spkr.speaker)
-
-        # Implemented after feedback from Kirk
-		# Counter objects have a dictionary interface except that
-		# they return a zero count for missing items instead
-		# of raising a KeyError
-		speakerArray = []
-	  	appearances = 0
-	  	dict = Counter(speaker_list)
-	  	for key in dict:
-			value = dict[key]
-			if value > appearances:
-	  			appearances = value
-	  			speaker = key
-			# Speaker with most appearances
-  			speakerArray = [speaker, appearances]
-
-        featuredSpeaker = speakerArray[0]
-        speakerAppearances = speakerArray[1]
-
-        if speakerAppearances >= 2:
-        	memcache.set(MEMCACHE_FEATURED_KEY, featuredSpeaker)
-        	featured = featuredSpeaker
+        if tally and tally.featuredCount >= FEATURED_SPEAKER_MIN_SESSIONS:
+            featured = tally.featuredSpeaker
+            memcache.set(MEMCACHE_FEATURED_KEY + websafeConferenceKey, featured)
+        else:
+            memcache.delete(MEMCACHE_FEATURED_KEY + websafeConferenceKey)
 
         return featured
 
     @endpoints.method(FEATURED_REQUEST, StringMessage,
-            path='conference/featuredSpeaker',
+            path='conference/{websafeConferenceKey}/featuredSpeaker',
             http_method='GET',
             name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return featured speaker"""
-        featured = memcache.get(MEMCACHE_FEATURED_KEY)
+        """Return featured speaker of a conference"""
+        wsck = request.websafeConferenceKey
+        featured = memcache.get(MEMCACHE_FEATURED_KEY + wsck)
+        if not featured:
+            featured = self._cacheFeaturedSpeaker(wsck)
         if not featured:
-        	featured = "There are 0 featured speakers"
+            featured = "There are 0 featured speakers"
         return StringMessage(data=featured)
 
+    @endpoints.method(POPULAR_REQUEST, PopularSessionForms,
+            path='conference/{websafeConferenceKey}/popularSessions',
+            http_method='GET', name='getPopularSessions')
+    def getPopularSessions(self, request):
+        """Return the sessions of a conference on the most wishlists"""
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        limit = min(request.limit or DEFAULT_POPULAR_SESSIONS, MAX_PAGE_SIZE)
+        ranking = popularity.rankSessions(conf_key)[:limit]
+        sessions = cache.getEntities([sess_key for sess_key, count in ranking])
+        return PopularSessionForms(items=[
+            PopularSessionForm(session=self._copySessionToForm(sess),
+                               interest=count)
+            for sess, (sess_key, count) in zip(sessions, ranking) if sess])
+
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return converters.profileToForm(prof)
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore, creating new one if non-existent."""
+        return self._getProfileFromUserAsync().get_result()
+
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self):
+        """Return a future for the user Profile, creating new one if non-existent."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -715,7 +1162,7 @@ class ConferenceApi(remote.Service):
         # get Profile from datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = yield cache.getEntityAsync(p_key)
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -724,9 +1171,9 @@ class ConferenceApi(remote.Service):
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            yield profile.put_async()
 
-        return profile      # return Profile
+        raise ndb.Return(profile)      # return Profile
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
@@ -735,20 +1182,38 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
-            for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-                        #if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
-                        #else:
-                        #    setattr(prof, field, val)
-                        prof.put()
+            prof = self._saveProfile(prof.key, save_request)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
+    @ndb.transactional()
+    def _saveProfile(self, p_key, save_request):
+        """Copy the user-modifyable fields onto the Profile and return it.
+
+        The Profile is read from the datastore, never from the cache, so
+        a stale cached copy can't be written back over a newer one.
+        """
+        prof = p_key.get(use_cache=False, use_memcache=False)
+        display_name = prof.displayName
+        changed = False
+        for field in ('displayName', 'teeShirtSize'):
+            val = getattr(save_request, field, None)
+            if val and getattr(prof, field) != str(val):
+                setattr(prof, field, str(val))
+                changed = True
+        if changed:
+            prof.put()
+            cache.invalidate(p_key)
+
+        # copy a new displayName onto the user's conferences
+        if prof.displayName != display_name:
+            taskqueue.add(params={'userId': p_key.id()},
+                url='/tasks/update_organizer_name',
+                transactional=True
+            )
+        return prof
+
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
@@ -761,111 +1226,284 @@ class ConferenceApi(remote.Service):
         """Update & return user profile."""
         return self._doProfile(request)
 
+    @staticmethod
+    def _updateOrganizerDisplayName(user_id):
+        """Copy organizer's displayName onto the conferences they created;
+        used by the update_organizer_name task queued from saveProfile().
+        """
+        p_key = ndb.Key(Profile, user_id)
+        prof = p_key.get()
+        if not prof:
+            return
+
+        # ancestor query, so the conferences are strongly consistent
+        confs = [conf for conf in Conference.query(ancestor=p_key)
+                 if conf.organizerDisplayName != prof.displayName]
+        for conf in confs:
+            conf.organizerDisplayName = prof.displayName
+        ndb.put_multi(confs)
+        cache.invalidate(*[conf.key for conf in confs])
+        for conf in confs:
+            agenda.scheduleRefresh(conf.key)
+
+    @staticmethod
+    def _backfillOrganizerDisplayNames(websafeCursor=None):
+        """Copy the organizer's displayName onto a batch of conferences
+        created before Conference stored it; queues itself for the next
+        batch."""
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        confs, next_cursor, more = Conference.query().fetch_page(
+            100, start_cursor=cursor)
+        profs = ndb.get_multi([conf.key.parent() for conf in confs])
+        changed = []
+        for conf, prof in zip(confs, profs):
+            if prof and conf.organizerDisplayName != prof.displayName:
+                conf.organizerDisplayName = prof.displayName
+                changed.append(conf)
+        confs = changed
+        ndb.put_multi(confs)
+        cache.invalidate(*[conf.key for conf in confs])
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/backfill_organizer_names'
+            )
+
+    @endpoints.method(message_types.VoidMessage, AgendaForm,
+            path='agenda', http_method='GET', name='getAgenda')
+    def getAgenda(self, request):
+        """Return the conferences the user attends & the sessions on their
+        wishlist, from one precomputed document."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return agenda.getAgenda(ndb.Key(Profile, getUserId(user)))
+
+# - - - Reporting - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(message_types.VoidMessage, ExportReportForm,
+            path='export/report',
+            http_method='GET', name='getExportReport')
+    def getExportReport(self, request):
+        """Return registrations per city, month & topic, as of the latest
+        finished export."""
+        report = export.LATEST_REPORT_KEY.get()
+        if not report:
+            raise endpoints.NotFoundException('No export has finished yet')
+
+        def forms(group):
+            counts = report.aggregates.get(group, {})
+            return [AggregateForm(name=name, registrations=counts[name])
+                    for name in sorted(counts)]
+
+        return ExportReportForm(
+            exportId=report.exportId,
+            created=str(report.created),
+            cities=forms('city'),
+            months=forms('month'),
+            topics=forms('topic'),
+        )
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+    def _setAnnouncement(conferences):
+        """Format the announcement for the nearly sold out conferences
+        ({websafeConferenceKey: name}) & assign it to memcache.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
+        if conferences:
             # If there are almost sold out conferences,
             # format announcement and set it in memcache
             announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
+                ', '.join(sorted(conferences.values())))
             memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         else:
             # If there are no sold out conferences,
             # delete the memcache announcements entry
             announcement = ""
             memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
         return announcement
 
+    @staticmethod
+    def _cacheAnnouncement():
+        """Rebuild the nearly sold out set & the announcement from the
+        conferences' seatsAvailable; used by the reconciliation cron job.
+        Registrations keep both up to date in between.
+        """
+        confs = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0)
+        ).fetch(projection=[Conference.name])
+
+        conferences = dict((conf.key.urlsafe(), conf.name) for conf in confs)
+        nearly_sold_out = NEARLY_SOLD_OUT_KEY.get()
+        if not nearly_sold_out or nearly_sold_out.conferences != conferences:
+            NearlySoldOut(key=NEARLY_SOLD_OUT_KEY, conferences=conferences).put()
+        return ConferenceApi._setAnnouncement(conferences)
+
+    @staticmethod
+    @ndb.transactional()
+    def _moveNearlySoldOut(conf, nearly):
+        """Add conf to (or drop it from) the nearly sold out set; return
+        the new set, or None if conf was already in the right place."""
+        nearly_sold_out = NEARLY_SOLD_OUT_KEY.get()
+        if not nearly_sold_out:
+            nearly_sold_out = NearlySoldOut(key=NEARLY_SOLD_OUT_KEY,
+                                            conferences={})
+        conferences = nearly_sold_out.conferences
+        wsck = conf.key.urlsafe()
+        if nearly == (wsck in conferences):
+            return None
+        if nearly:
+            conferences[wsck] = conf.name
+        else:
+            del conferences[wsck]
+        nearly_sold_out.put()
+        return conferences
+
+    @staticmethod
+    def _updateNearlySoldOut(conf, seats_left):
+        """Update the nearly sold out set & the announcement when a
+        conference crosses the threshold; cheap when it doesn't."""
+        nearly = 0 < seats_left <= NEARLY_SOLD_OUT_SEATS
+        nearly_sold_out = NEARLY_SOLD_OUT_KEY.get()
+        listed = bool(nearly_sold_out and
+                      conf.key.urlsafe() in nearly_sold_out.conferences)
+        if nearly == listed:
+            return
+        conferences = ConferenceApi._moveNearlySoldOut(conf, nearly)
+        if conferences is not None:
+            ConferenceApi._setAnnouncement(conferences)
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if announcement is None:
+            # evicted (or nothing nearly sold out); rebuild from the set
+            nearly_sold_out = NEARLY_SOLD_OUT_KEY.get()
+            announcement = self._setAnnouncement(
+                nearly_sold_out.conferences if nearly_sold_out else {})
+        return StringMessage(data=announcement)
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
+        # fetch user Profile and conference in parallel
+        wsck = request.websafeConferenceKey
+        prof_future = self._getProfileFromUserAsync()
+        conf_future = cache.getEntityAsync(wsck)
+        prof = prof_future.get_result() # get user Profile
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = conf_future.get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        # seats are spread over shards, each in its own entity group, so
+        # registrations for one conference don't contend on one entity
+        shard_keys = seats.getShardKeys(conf)
+
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if conf.key in prof.conferenceKeysToAttend:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # try the shards that still have seats, in random order; a
+            # contended shard is skipped in favour of the next one
+            open_keys = [shard.key for shard in ndb.get_multi(shard_keys)
+                         if shard.seatsAvailable > 0]
+            random.shuffle(open_keys)
+            failure = None
+            for shard_key in open_keys:
+                try:
+                    retval = self._registerOnShard(
+                        prof.key, shard_key, conf, reg)
+                except datastore_errors.TransactionFailedError as e:
+                    failure = e
+                    continue
+                if retval is not None:
+                    break
+            else:
+                # every shard was tried; only blame contention if that
+                # is what kept the user from a seat
+                if failure:
+                    raise failure
+                # check if seats avail
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if conf.key not in prof.conferenceKeysToAttend:
+                return BooleanMessage(data=False)
+            retval = self._registerOnShard(
+                prof.key, random.choice(shard_keys), conf, reg)
+
+        if retval:
+            seats.scheduleSync(conf.key)
+            # announce the conference as soon as it is nearly sold out
+            self._updateNearlySoldOut(conf, seats.countShardSeats(shard_keys))
+        return BooleanMessage(data=retval)
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+    @ndb.transactional(xg=True)
+    def _registerOnShard(self, p_key, shard_key, conf, reg):
+        """Take (or give back) one seat of a SeatShard for the user, and
+        update the user's Agenda.
+
+        Returns None if the shard has no seat left, so the caller can try
+        another one.
+        """
+        conf_key = conf.key
+        prof, shard, user_agenda = ndb.get_multi(
+            [p_key, shard_key, agenda.agendaKey(p_key)])
+
+        if reg:
+            if conf_key in prof.conferenceKeysToAttend:
+                raise ConflictException(
+                    "You have already registered for this conference")
+            if shard.seatsAvailable <= 0:
+                return None
+
+            # register user, take away one seat
+            prof.conferenceKeysToAttend.append(conf_key)
+            shard.seatsAvailable -= 1
+            user_agenda = agenda.editAgenda(user_agenda, add_conferences=[conf])
+        else:
+            if conf_key not in prof.conferenceKeysToAttend:
+                return False
+
+            # unregister user, add back one seat
+            prof.conferenceKeysToAttend.remove(conf_key)
+            shard.seatsAvailable += 1
+            user_agenda = agenda.editAgenda(user_agenda,
+                                            remove_conference_keys=[conf_key])
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        ndb.put_multi([entity for entity in (prof, shard, user_agenda) if entity])
+        cache.invalidate(p_key)
+        return True
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
-        """Get list of conferences that user has registered for."""
+        """Get a page of the conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        keys, next_token = self._pageOfKeys(prof.conferenceKeysToAttend, request)
+        conferences = cache.getEntities(keys)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
-        )
+        return ConferenceForms(items=[self._copyConferenceToForm(conf)
+                                      for conf in conferences if conf],
+                               nextPageToken=next_token)
 
     @endpoints.method(CONFERENCE_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
@@ -886,18 +1524,15 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='filterPlayground')
     def filterPlayground(self, request):
         """Filter Playground"""
-        q = Conference.query()
-        # field = "city"
-        # operator = "="
-        # value = "London"
-        # f = ndb.query.FilterNode(field, operator, value)
-        # q = q.filter(f)
-        q = q.filter(Conference.city=="London")
-        q = q.filter(Conference.topics=="Medical Innovations")
-        q = q.filter(Conference.month==6)
+        q, filters = self._plannedQuery([
+            {"field": "city", "operator": "=", "value": "London"},
+            {"field": "topics", "operator": "=", "value": "Medical Innovations"},
+            {"field": "month", "operator": "=", "value": 6},
+        ])
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=[self._copyConferenceToForm(conf) for conf in q
+                   if planner.matches(conf, filters)]
         )
 
 api = endpoints.api_server([ConferenceApi]) # register API
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+converters.py -- Udacity conference server-side Python App Engine
+    entity to ProtoRPC message converters
+
+$Id$
+
+compileConverter() works out once, at import time, which message fields
+are copied from which entity properties and how each one is converted.
+Converting an entity is then a walk over that table, instead of
+all_fields() plus hasattr() and name tests for every field of every
+entity.
+"""
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import SessionType
+from models import TeeShirtSize
+
+
+def _enum(enum_class):
+    """Return a conversion from an enum name to its value."""
+    return lambda name: getattr(enum_class, name)
+
+
+def _urlsafeKeys(keys):
+    return [key.urlsafe() for key in keys]
+
+
+def compileConverter(message_class, model_class, conversions=None):
+    """Return a function copying an entity of model_class to a new
+    message_class message.
+
+    Fields named like a property of model_class are copied, through
+    conversions[name] if given; a websafeKey field that isn't a property
+    gets the entity's urlsafe key.
+    """
+    conversions = conversions or {}
+    table = []
+    key_field = None
+    for field in message_class.all_fields():
+        if hasattr(model_class, field.name):
+            table.append((field.name, conversions.get(field.name)))
+        elif field.name == 'websafeKey':
+            key_field = field.name
+    table = tuple(table)
+    check = any(field.required for field in message_class.all_fields())
+
+    def convert(entity):
+        message = message_class()
+        for name, conversion in table:
+            value = getattr(entity, name)
+            if conversion is not None:
+                value = conversion(value)
+            setattr(message, name, value)
+        if key_field:
+            setattr(message, key_field, entity.key.urlsafe())
+        if check:
+            message.check_initialized()
+        return message
+
+    return convert
+
+
+# convert Date to date string; just copy others
+conferenceToForm = compileConverter(ConferenceForm, Conference, {
+    'startDate': str,
+    'endDate': str,
+})
+
+sessionToForm = compileConverter(SessionForm, Session, {
+    'typeOfSession': _enum(SessionType),
+    'date': str,
+    'startTime': str,
+    'duration': str,
+    'speaker': str,
+})
+
+# convert t-shirt string to Enum; keys go out as websafe strings
+profileToForm = compileConverter(ProfileForm, Profile, {
+    'teeShirtSize': _enum(TeeShirtSize),
+    'conferenceKeysToAttend': _urlsafeKeys,
+    'sessWishlist': _urlsafeKeys,
+})
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""
+export.py -- Udacity conference server-side Python App Engine
+    bulk export of conferences, sessions & profiles, with aggregates
+    for reporting
+
+$Id$
+
+startExport() splits every kind into up to SHARDS_PER_KIND key ranges,
+picked from the __scatter__ property the datastore sets on a random
+sample of entities, and starts one chain of export_chunk tasks per
+range; all the chains run in parallel. Each task reads up to CHUNK_SIZE
+entities of its range after the previous task's cursor and stores them
+as one gzipped NDJSON ExportChunk (one JSON object per line). A chunk
+stops early once its NDJSON reaches MAX_CHUNK_BYTES, so it stays under
+the 1MB entity limit however big the entities are. Chunk ids
+and task names are derived from the export, kind, shard & chunk index,
+so a retried task overwrites its chunk and can't fork the chain.
+
+While walking conferences the registrations (maxAttendees -
+seatsAvailable) are added up per city, month & topic. Once every kind
+is done they are copied to the ExportReport 'latest', which is what
+reports read instead of the live Conference entities, and a
+delete_exports task deletes the older exports and their chunks.
+"""
+
+import gzip
+import json
+import time
+from cStringIO import StringIO
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Export
+from models import ExportChunk
+from models import ExportReport
+from models import Profile
+from models import Session
+
+EXPORT_MODELS = dict((model.__name__, model)
+                     for model in (Conference, Session, Profile))
+CHUNK_SIZE = 500
+# uncompressed NDJSON per chunk; gzip only makes it smaller
+MAX_CHUNK_BYTES = 900 * 1024
+DELETE_BATCH = 500
+SHARDS_PER_KIND = 4
+# scatter keys sampled per split point
+OVERSAMPLING = 8
+LATEST_REPORT_KEY = ndb.Key(ExportReport, 'latest')
+
+
+def _splitKeys(kind):
+    """Return up to SHARDS_PER_KIND - 1 keys that split kind into key
+    ranges of about the same size."""
+    model = EXPORT_MODELS[kind]
+    keys = sorted(model.query().order(ndb.GenericProperty('__scatter__')).fetch(
+        (SHARDS_PER_KIND - 1) * OVERSAMPLING, keys_only=True))
+    if len(keys) < SHARDS_PER_KIND:
+        return []
+    step = float(len(keys)) / SHARDS_PER_KIND
+    return sorted(set(keys[int(step * i)] for i in range(1, SHARDS_PER_KIND)))
+
+
+def startExport():
+    """Start an export of every kind; return its id."""
+    export_id = time.strftime('%Y%m%d-%H%M%S')
+    ranges = []
+    for kind in sorted(EXPORT_MODELS):
+        splits = [None] + _splitKeys(kind) + [None]
+        for shard in range(len(splits) - 1):
+            ranges.append((kind, shard, splits[shard], splits[shard + 1]))
+    Export(id=export_id, aggregates={},
+           pendingShards=['%s-%d' % (kind, shard)
+                          for kind, shard, start, end in ranges]).put()
+    for kind, shard, start, end in ranges:
+        _queueChunk(export_id, kind, shard, start and start.urlsafe(),
+                    end and end.urlsafe(), 0)
+    return export_id
+
+
+def _queueChunk(export_id, kind, shard, start, end, index, websafeCursor=''):
+    try:
+        taskqueue.add(
+            name='export-%s-%s-%d-%d' % (export_id, kind, shard, index),
+            params={'exportId': export_id, 'kind': kind, 'shard': shard,
+                    'start': start or '', 'end': end or '',
+                    'index': index, 'cursor': websafeCursor},
+            url='/tasks/export_chunk',
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def _jsonDefault(value):
+    """Serialize the property values json doesn't know about."""
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if hasattr(value, 'isoformat'):
+        # date, datetime & time
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+def _toJsonLine(entity):
+    """Return entity as one NDJSON line, with its urlsafe key."""
+    row = entity.to_dict()
+    row['key'] = entity.key.urlsafe()
+    return json.dumps(row, default=_jsonDefault, sort_keys=True) + '\n'
+
+
+def _gzip(lines):
+    """Return the lines gzipped."""
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    for line in lines:
+        f.write(line)
+    f.close()
+    return buf.getvalue()
+
+
+def _registrations(confs):
+    """Add up registrations per city, month & topic."""
+    aggregates = {'city': {}, 'month': {}, 'topic': {}}
+
+    def add(group, name, count):
+        aggregates[group][name] = aggregates[group].get(name, 0) + count
+
+    for conf in confs:
+        if not conf.maxAttendees:
+            continue
+        count = conf.maxAttendees - (conf.seatsAvailable or 0)
+        add('city', conf.city or '', count)
+        add('month', str(conf.month or 0), count)
+        for topic in conf.topics:
+            add('topic', topic, count)
+    return aggregates
+
+
+@ndb.transactional(xg=True)
+def _finishChunk(export_id, chunk_id, shard_name, aggregates, last):
+    """Merge a chunk's aggregates into the export (once per chunk) and
+    mark the shard done after its last chunk."""
+    export = ndb.Key(Export, export_id).get()
+    if not export or chunk_id in export.doneChunks:
+        # deleted by a newer export, or a retried task
+        return
+    export.doneChunks.append(chunk_id)
+    for group, counts in aggregates.items():
+        totals = export.aggregates.setdefault(group, {})
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+    if last and shard_name in export.pendingShards:
+        export.pendingShards.remove(shard_name)
+    if not export.pendingShards:
+        export.finished = True
+        ExportReport(key=LATEST_REPORT_KEY, exportId=export_id,
+                     aggregates=export.aggregates).put()
+        # the report no longer needs the older exports
+        taskqueue.add(params={'exportId': export_id},
+                      url='/tasks/delete_exports', transactional=True)
+    export.put()
+
+
+def exportChunk(export_id, kind, shard, start, end, index, websafeCursor=None):
+    """Export the next CHUNK_SIZE entities (or MAX_CHUNK_BYTES of NDJSON)
+    of a key range (start and end are urlsafe keys, or empty for an open
+    end) of kind, then queue the task for the chunk after it."""
+    if not ndb.Key(Export, export_id).get():
+        # deleted by a newer export
+        return
+    model = EXPORT_MODELS[kind]
+    query = model.query().order(model.key)
+    if start:
+        query = query.filter(model.key >= ndb.Key(urlsafe=start))
+    if end:
+        query = query.filter(model.key < ndb.Key(urlsafe=end))
+    cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+    results = query.iter(start_cursor=cursor, produce_cursors=True,
+                         batch_size=CHUNK_SIZE + 1)
+    entities = []
+    lines = []
+    size = 0
+    next_cursor = None
+    for entity in results:
+        line = _toJsonLine(entity)
+        if entities and (len(entities) == CHUNK_SIZE or
+                         size + len(line) > MAX_CHUNK_BYTES):
+            # the next chunk starts with this entity
+            next_cursor = results.cursor_before()
+            break
+        entities.append(entity)
+        lines.append(line)
+        size += len(line)
+
+    chunk_id = '%s-%s-%02d-%05d' % (export_id, kind, shard, index)
+    ExportChunk(id=chunk_id, exportId=export_id, kind=kind, shard=shard,
+                index=index, count=len(entities), data=_gzip(lines)).put()
+
+    # merge this chunk before queueing the next one, so a later chunk
+    # can't finish the export without it
+    last = next_cursor is None
+    aggregates = _registrations(entities) if kind == 'Conference' else {}
+    _finishChunk(export_id, chunk_id, '%s-%d' % (kind, shard), aggregates, last)
+    if not last:
+        _queueChunk(export_id, kind, shard, start, end, index + 1,
+                    next_cursor.urlsafe())
+
+
+def deleteOldExports(export_id):
+    """Delete the exports started before export_id and their chunks,
+    DELETE_BATCH chunks per call; queues itself until they are gone."""
+    old_ids = sorted(key.id() for key in Export.query().fetch(keys_only=True)
+                     if key.id() < export_id)
+    for old_id in old_ids:
+        chunk_keys = ExportChunk.query(ExportChunk.exportId == old_id).fetch(
+            DELETE_BATCH, keys_only=True)
+        if chunk_keys:
+            ndb.delete_multi(chunk_keys)
+            taskqueue.add(params={'exportId': export_id},
+                          url='/tasks/delete_exports')
+            return
+        ndb.Key(Export, old_id).delete()
+
+
+def readChunks(export_id, kind):
+    """Yield the rows of an export's kind, decompressed, in key order."""
+    chunks = ExportChunk.query(ExportChunk.exportId == export_id,
+                               ExportChunk.kind == kind)
+    for chunk in sorted(chunks, key=lambda chunk: (chunk.shard, chunk.index)):
+        f = gzip.GzipFile(fileobj=StringIO(chunk.data))
+        for line in f:
+            yield json.loads(line)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+loadtest.py -- Udacity conference server-side Python App Engine
+    in-process load test of ConferenceApi against the local datastore,
+    memcache, task queue, urlfetch & mail stubs
+
+$Id$
+
+Run from this directory with the App Engine SDK on the Python path:
+
+    python loadtest.py [users] [rounds]
+
+Synthetic users create profiles, every ORGANIZER_EVERY-th one organizes
+a conference with sessions, and then every user registers, browses and
+edits a wishlist for `rounds` rounds. For each endpoint it prints p50 &
+p99 latency and the API calls (datastore_v3.Get, memcache.Get, ...) made
+per request, so an extra get in a handler shows up as a changed count.
+Queued tasks are not run.
+"""
+
+import os
+import random
+import sys
+import time
+
+import endpoints
+from protorpc import message_types
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import ConferenceForm
+from models import ConferenceQueryForms
+
+import conference
+
+USERS = 50
+ROUNDS = 5
+ORGANIZER_EVERY = 10
+SESSIONS_PER_CONFERENCE = 5
+SEED = 42
+
+
+def setUpTestbed():
+    """Activate the local service stubs and return the testbed."""
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(overwrite=True,
+                 ENDPOINTS_AUTH_EMAIL='bench@example.com',
+                 ENDPOINTS_AUTH_DOMAIN='example.com')
+    # strongly consistent, like the ancestor queries the handlers run
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=os.path.dirname(os.path.abspath(__file__)))
+    tb.init_urlfetch_stub()
+    tb.init_mail_stub()
+    ndb.get_context().clear_cache()
+    return tb
+
+
+def setUser(email):
+    """Make the following API calls on behalf of email."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+
+
+def percentile(timings, p):
+    """Return the p-th percentile of sorted timings."""
+    return timings[int(round(p / 100.0 * (len(timings) - 1)))]
+
+
+class Recorder(object):
+    """Time API calls and count the service calls they make."""
+
+    def __init__(self):
+        self.timings = {}
+        self.rpcs = {}
+        self.errors = {}
+        self._current = None
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'loadtest-%d' % id(self), self._countRpc)
+
+    def _countRpc(self, service, call, request, response):
+        if self._current is not None:
+            name = '%s.%s' % (service, call)
+            self._current[name] = self._current.get(name, 0) + 1
+
+    def measure(self, label, func, *args):
+        """Call func(*args) as one request of endpoint label; return its
+        result, or None if it raised an endpoints error."""
+        # don't let ndb's in-context cache carry over between requests
+        ndb.get_context().clear_cache()
+        self._current = {}
+        start = time.time()
+        try:
+            return func(*args)
+        except endpoints.ServiceException:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        finally:
+            elapsed = (time.time() - start) * 1000
+            self.timings.setdefault(label, []).append(elapsed)
+            rpcs = self.rpcs.setdefault(label, {})
+            for name, count in self._current.items():
+                rpcs[name] = rpcs.get(name, 0) + count
+            self._current = None
+
+    def report(self):
+        """Print p50/p99 latency and API calls per request per endpoint."""
+        for label in sorted(self.timings):
+            timings = sorted(self.timings[label])
+            print '%-28s n %5d   p50 %7.2f ms   p99 %7.2f ms   errors %d' % (
+                label, len(timings), percentile(timings, 50),
+                percentile(timings, 99), self.errors.get(label, 0))
+            for name, count in sorted(self.rpcs[label].items()):
+                print '    %-32s %6.2f per call' % (
+                    name, float(count) / len(timings))
+
+
+def run(users=USERS, rounds=ROUNDS, seed=SEED):
+    """Drive ConferenceApi with synthetic users; return the Recorder."""
+    rand = random.Random(seed)
+    api = conference.ConferenceApi()
+    recorder = Recorder()
+    emails = ['user%d@example.com' % i for i in range(users)]
+
+    for email in emails:
+        setUser(email)
+        recorder.measure('getProfile', api.getProfile,
+                         message_types.VoidMessage())
+
+    session_request = conference.SESSION_POST_REQUEST.combined_message_class
+    wscks = []
+    for i, email in enumerate(emails[::ORGANIZER_EVERY]):
+        setUser(email)
+        conf = recorder.measure('createConference', api.createConference,
+            ConferenceForm(name='Conference %d' % i, city='London',
+                           maxAttendees=users, startDate='2016-05-01'))
+        wsck = conference.Conference.query(
+            conference.Conference.name == conf.name).get().key.urlsafe()
+        wscks.append(wsck)
+        for j in range(SESSIONS_PER_CONFERENCE):
+            recorder.measure('createSession', api.createSession,
+                session_request(websafeConferenceKey=wsck,
+                                name='Session %d' % j,
+                                speaker='Speaker %d' % (j % 2)))
+
+    conf_request = conference.CONFERENCE_GET_REQUEST.combined_message_class
+    sessions_request = conference.SESSION_GET_REQUEST.combined_message_class
+    wishlist_request = conference.WISHLIST_POST_REQUEST.combined_message_class
+    list_request = conference.CONF_LIST_REQUEST.combined_message_class
+    for i in range(rounds):
+        for email in emails:
+            setUser(email)
+            wsck = rand.choice(wscks)
+            recorder.measure('registerForConference',
+                api.registerForConference, conf_request(websafeConferenceKey=wsck))
+            recorder.measure('queryConferences', api.queryConferences,
+                ConferenceQueryForms())
+            sessions = recorder.measure('getConferenceSessions',
+                api.getConferenceSessions,
+                sessions_request(websafeConferenceKey=wsck))
+            if sessions and sessions.items:
+                wssk = rand.choice(sessions.items).websafeKey
+                recorder.measure('addSessionToWishlist',
+                    api.addSessionToWishlist,
+                    wishlist_request(websafeSessionKey=wssk))
+                recorder.measure('getSessionsInWishlist',
+                    api.getSessionsInWishlist, list_request())
+                recorder.measure('deleteSessionInWishlist',
+                    api.deleteSessionInWishlist,
+                    wishlist_request(websafeSessionKey=wssk))
+            recorder.measure('getConferencesToAttend',
+                api.getConferencesToAttend, list_request())
+            recorder.measure('unregisterFromConference',
+                api.unregisterFromConference,
+                conf_request(websafeConferenceKey=wsck))
+    return recorder
+
+
+def main(users, rounds):
+    tb = setUpTestbed()
+    run(users, rounds).report()
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else USERS,
+         int(sys.argv[2]) if len(sys.argv) > 2 else ROUNDS)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+mailer.py -- Udacity conference server-side Python App Engine
+    batched, rate-limited sending of conference confirmation emails
+
+$Id$
+
+Confirmation emails are queued as tasks on the confirmation-email pull
+queue. A cron job calls sendQueuedEmails() every minute, which leases
+tasks in batches and sends them from a few threads, at most
+MAILS_PER_SECOND overall.
+
+Every email carries an idempotency key. A SentMail entity with that key
+is created in a transaction before the email is sent, so a retried task
+never sends the same email twice. If the instance dies between the
+transaction and the send, that email is dropped rather than sent twice.
+
+Locally, run it against the testbed mail & task queue stubs (with
+root_path pointing at this directory, so queue.yaml is picked up) and
+check the stub's get_sent_messages().
+"""
+
+import json
+import logging
+import os
+import string
+import threading
+import time
+import Queue
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SentMail
+
+MAIL_QUEUE = 'confirmation-email'
+LEASE_SECONDS = 60
+LEASE_BATCH = 100
+WORK_SECONDS = 50
+SEND_THREADS = 5
+MAILS_PER_SECOND = 5
+MAX_RETRIES = 5
+
+SUBJECT = 'You created a new Conference!'
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'templates',
+                             'confirmation_email.txt')
+
+_template = None
+
+
+def _getTemplate():
+    """Return the email body template, read once per instance."""
+    global _template
+    if _template is None:
+        with open(TEMPLATE_PATH) as f:
+            _template = string.Template(f.read())
+    return _template
+
+
+def renderEmail(conferenceInfo):
+    """Return the body of a confirmation email."""
+    return _getTemplate().substitute(conferenceInfo=conferenceInfo)
+
+
+def sendEmail(to, conferenceInfo):
+    """Send one confirmation email right away."""
+    mail.send_mail(
+        'noreply@%s.appspotmail.com' % app_identity.get_application_id(),
+        to, SUBJECT, renderEmail(conferenceInfo))
+
+
+def queueConfirmationEmails(to, emails):
+    """Queue confirmation emails to `to`; emails is a list of
+    (idempotency_key, conferenceInfo) pairs.
+    """
+    tasks = [taskqueue.Task(method='PULL', payload=json.dumps({
+                 'id': key, 'to': to, 'conferenceInfo': info}))
+             for key, info in emails]
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+        queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+
+class _RateLimiter(object):
+    """Let at most `rate` callers per second through wait(), across
+    threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+@ndb.transactional()
+def _claim(key):
+    """Create the SentMail marker for key; False if it already exists."""
+    if SentMail.get_by_id(key):
+        return False
+    SentMail(id=key).put()
+    return True
+
+
+def _sendTask(task, limiter):
+    """Send the email of a leased task; return True if the task is done
+    (sent now or before) and can be deleted.
+    """
+    message = json.loads(task.payload)
+    if not _claim(message['id']):
+        return True
+    limiter.wait()
+    try:
+        sendEmail(message['to'], message['conferenceInfo'])
+    except Exception:
+        logging.exception('Sending confirmation email %s failed', message['id'])
+        # give the retry its chance to send
+        ndb.Key(SentMail, message['id']).delete()
+        return False
+    return True
+
+
+def _sendBatch(tasks, limiter):
+    """Send a batch of leased tasks from SEND_THREADS threads; return the
+    tasks that are done."""
+    pending = Queue.Queue()
+    for task in tasks:
+        pending.put(task)
+    done = []
+
+    def worker():
+        while True:
+            try:
+                task = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                if _sendTask(task, limiter):
+                    done.append(task)
+            except Exception:
+                logging.exception('Confirmation email task %s failed', task.name)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(SEND_THREADS, len(tasks)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return done
+
+
+def sendQueuedEmails(work_seconds=WORK_SECONDS):
+    """Lease and send queued confirmation emails for up to work_seconds;
+    return the number of tasks done.
+
+    Failed tasks stay on the queue and are leased again once their lease
+    runs out; after MAX_RETRIES they are dropped.
+    """
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    limiter = _RateLimiter(MAILS_PER_SECOND)
+    deadline = time.time() + work_seconds
+    count = 0
+    while time.time() < deadline:
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH)
+        if not tasks:
+            break
+        expired = [task for task in tasks if task.retry_count > MAX_RETRIES]
+        for task in expired:
+            logging.error('Dropping confirmation email task %s: %s',
+                          task.name, task.payload)
+        tasks = [task for task in tasks if task.retry_count <= MAX_RETRIES]
+        done = _sendBatch(tasks, limiter)
+        if done or expired:
+            queue.delete_tasks(done + expired)
+        count += len(done)
+    return count
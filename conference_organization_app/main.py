@@ -13,13 +13,18 @@ updated by Petros Kalogiannakis on 2016 feb 02
 __author__ = 'Wesley Chun, Petros Kalogiannakis'
 
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
 from google.appengine.ext import ndb
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from conference import ConferenceApi
 from models import Session
 
+import agenda
+import export
+import mailer
+import popularity
+import seats
+
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
         """Set Announcement in Memcache."""
@@ -28,16 +33,47 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
+        """Send email confirming Conference creation; only for push tasks
+        queued before confirmation emails moved to the pull queue."""
+        mailer.sendEmail(self.request.get('email'),
+                         self.request.get('conferenceInfo'))
+
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send queued confirmation emails, in batches."""
+        mailer.sendQueuedEmails()
+        self.response.set_status(204)
+
+class RefreshAgendasHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the agendas of a conference's attendees, in batches."""
+        agenda.refreshAgendas(self.request.get('websafeConferenceKey'),
+                              self.request.get('cursor'))
+        self.response.set_status(204)
+
+class StartExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a bulk export of conferences, sessions & profiles."""
+        export.startExport()
+        self.response.set_status(204)
+
+class ExportChunkHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export the next chunk of one shard of a kind."""
+        export.exportChunk(self.request.get('exportId'),
+                           self.request.get('kind'),
+                           int(self.request.get('shard')),
+                           self.request.get('start'),
+                           self.request.get('end'),
+                           int(self.request.get('index')),
+                           self.request.get('cursor'))
+        self.response.set_status(204)
+
+class DeleteExportsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Delete the exports older than a finished one, in batches."""
+        export.deleteOldExports(self.request.get('exportId'))
+        self.response.set_status(204)
 
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
@@ -45,8 +81,74 @@ class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
         ConferenceApi._cacheFeaturedSpeaker(self.request.get('websafeConferenceKey'))
         self.response.set_status(204)
 
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy a changed displayName onto the organizer's conferences."""
+        ConferenceApi._updateOrganizerDisplayName(self.request.get('userId'))
+        self.response.set_status(204)
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy the seat shard total onto the Conference."""
+        seats.syncSeats(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class BackfillSessionsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the session backfill; open this url once as an admin."""
+        taskqueue.add(url='/tasks/backfill_sessions')
+        self.response.set_status(202)
+
+    def post(self):
+        """Fill in the search fields of existing sessions, in batches."""
+        ConferenceApi._backfillSessionSearchFields(self.request.get('cursor'))
+        self.response.set_status(204)
+
+class BackfillOrganizerNamesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the organizer name backfill; open this url once as an admin."""
+        taskqueue.add(url='/tasks/backfill_organizer_names')
+        self.response.set_status(202)
+
+    def post(self):
+        """Fill in the organizer name of existing conferences, in batches."""
+        ConferenceApi._backfillOrganizerDisplayNames(self.request.get('cursor'))
+        self.response.set_status(204)
+
+class CountInterestHandler(webapp2.RequestHandler):
+    def post(self):
+        """Count a committed wishlist change on the interest shards."""
+        popularity.countInterest(
+            self.request.get('changeId'),
+            [ndb.Key(urlsafe=wssk) for wssk in self.request.get_all('added')],
+            [ndb.Key(urlsafe=wssk) for wssk in self.request.get_all('removed')])
+        self.response.set_status(204)
+
+class PruneCountedChangesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete old wishlist change markers; run by cron."""
+        popularity.pruneCountedChanges()
+        self.response.set_status(204)
+
+    def post(self):
+        """Delete the next batch of old wishlist change markers."""
+        popularity.pruneCountedChanges()
+        self.response.set_status(204)
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/crons/start_export', StartExportHandler),
+    ('/crons/prune_counted_changes', PruneCountedChangesHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/featured_speaker', SetFeaturedSpeakerHandler)
+    ('/tasks/featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/backfill_sessions', BackfillSessionsHandler),
+    ('/tasks/backfill_organizer_names', BackfillOrganizerNamesHandler),
+    ('/tasks/export_chunk', ExportChunkHandler),
+    ('/tasks/delete_exports', DeleteExportsHandler),
+    ('/tasks/refresh_agendas', RefreshAgendasHandler),
+    ('/tasks/count_interest', CountInterestHandler),
+    ('/tasks/prune_counted_changes', PruneCountedChangesHandler)
 ], debug=True)
@@ -23,11 +23,44 @@ class ConflictException(endpoints.ServiceException):
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
+    # cache.py keeps Profiles in memcache; don't cache them twice
+    _use_memcache = False
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessWishlist = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.KeyProperty('conferenceKeys', kind='Conference', repeated=True)
+    sessWishlist = ndb.KeyProperty('sessionKeys', kind='Session', repeated=True)
+    # urlsafe key strings stored by earlier versions; folded in on get
+    legacyConferenceKeys = ndb.StringProperty('conferenceKeysToAttend', repeated=True)
+    legacySessWishlist = ndb.StringProperty('sessWishlist', repeated=True)
+
+    @classmethod
+    def _post_get_hook(cls, key, future):
+        prof = future.get_result()
+        if prof:
+            prof._foldLegacyKeys()
+
+    def _pre_put_hook(self):
+        self._foldLegacyKeys()
+
+    def _foldLegacyKeys(self):
+        """Move legacy urlsafe strings into the key lists, which hold
+        each key once (set semantics, insertion order kept)."""
+        self.conferenceKeysToAttend = _uniqueKeys(self.conferenceKeysToAttend +
+            [ndb.Key(urlsafe=wsck) for wsck in self.legacyConferenceKeys])
+        self.sessWishlist = _uniqueKeys(self.sessWishlist +
+            [ndb.Key(urlsafe=wssk) for wssk in self.legacySessWishlist])
+        self.legacyConferenceKeys = []
+        self.legacySessWishlist = []
+
+def _uniqueKeys(keys):
+    """Return keys without duplicates, keeping the first occurrence."""
+    seen = set()
+    return [key for key in keys if not (key in seen or seen.add(key))]
+
+class CustomUserId(ndb.Model):
+    """CustomUserId -- generated user id, keyed by email"""
+    userId          = ndb.StringProperty(indexed=False)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -52,9 +85,12 @@ class BooleanMessage(messages.Message):
 
 class Conference(ndb.Model):
     """Conference -- Conference object"""
+    # cache.py keeps Conferences in memcache; don't cache them twice
+    _use_memcache = False
     name            = ndb.StringProperty(required=True)
     description     = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
@@ -62,6 +98,51 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a conference's available seats"""
+    conference      = ndb.KeyProperty(kind='Conference')
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- names of the nearly sold out conferences, by
+    urlsafe conference key"""
+    # no default: a shared default dict would be mutated in place
+    conferences     = ndb.JsonProperty()
+
+class SentMail(ndb.Model):
+    """SentMail -- marker for a confirmation email, keyed by its
+    idempotency key"""
+    created         = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class Export(ndb.Model):
+    """Export -- one run of the bulk export"""
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    # 'kind-shard' of the shards that are still being exported
+    pendingShards   = ndb.StringProperty(repeated=True, indexed=False)
+    doneChunks      = ndb.StringProperty(repeated=True, indexed=False)
+    aggregates      = ndb.JsonProperty()
+    finished        = ndb.BooleanProperty(default=False)
+
+class ExportChunk(ndb.Model):
+    """ExportChunk -- gzipped NDJSON rows of one kind of an export"""
+    exportId        = ndb.StringProperty()
+    kind            = ndb.StringProperty()
+    shard           = ndb.IntegerProperty(indexed=False)
+    index           = ndb.IntegerProperty(indexed=False)
+    count           = ndb.IntegerProperty(indexed=False)
+    data            = ndb.BlobProperty()
+
+class ExportReport(ndb.Model):
+    """ExportReport -- registration aggregates of a finished export"""
+    exportId        = ndb.StringProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+    aggregates      = ndb.JsonProperty()
+
+class Agenda(ndb.Model):
+    """Agenda -- encoded AgendaForm of a user; child of the Profile"""
+    data            = ndb.TextProperty()
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -78,12 +159,46 @@ class ConferenceForm(messages.Message):
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
 
+class WishlistConferenceForm(messages.Message):
+    """WishlistConferenceForm -- wishlist sessions of one conference"""
+    conference = messages.MessageField(ConferenceForm, 1)
+    sessions = messages.MessageField('SessionForm', 2, repeated=True)
+
+class WishlistConferenceForms(messages.Message):
+    """WishlistConferenceForms -- wishlist sessions grouped by conference"""
+    items = messages.MessageField(WishlistConferenceForm, 1, repeated=True)
+
+class WishlistUpdateForm(messages.Message):
+    """WishlistUpdateForm -- sessions to add to and remove from the wishlist"""
+    add = messages.StringField(1, repeated=True)
+    remove = messages.StringField(2, repeated=True)
+
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class AgendaForm(messages.Message):
+    """AgendaForm -- conferences a user attends & sessions on their wishlist"""
+    conferences = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions = messages.MessageField('SessionForm', 2, repeated=True)
+
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- lightweight Conference outbound form message"""
+    name            = messages.StringField(1)
+    city            = messages.StringField(2)
+    month           = messages.IntegerField(3, variant=messages.Variant.INT32)
+    websafeKey      = messages.StringField(4)
+
+class ConferenceSummaryForms(messages.Message):
+    """ConferenceSummaryForms -- multiple ConferenceSummary outbound form message"""
+    items = messages.MessageField(ConferenceSummaryForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 class Session(ndb.Model):
     """Session -- Session object"""
+    # cache.py keeps Sessions in memcache; don't cache them twice
+    _use_memcache = False
     name            = ndb.StringProperty()
     highlights      = ndb.StringProperty(repeated=True)
     speaker         = ndb.StringProperty()
@@ -91,6 +206,33 @@ class Session(ndb.Model):
     typeOfSession   = ndb.StringProperty()
     date            = ndb.DateProperty()
     startTime       = ndb.TimeProperty()
+    # precomputed for searchSessions, so that filtering on month and
+    # excluding a type are equality filters next to a startTime range
+    month           = ndb.IntegerProperty()
+    notTypeOfSession = ndb.StringProperty(repeated=True)
+
+    def _pre_put_hook(self):
+        self.month = self.date.month if self.date else 0
+        self.notTypeOfSession = [name for name in SessionType.names()
+                                 if name != self.typeOfSession]
+
+class SpeakerTally(ndb.Model):
+    """SpeakerTally -- number of sessions per speaker of a conference"""
+    counts          = ndb.JsonProperty()
+    featuredSpeaker = ndb.StringProperty(indexed=False)
+    featuredCount   = ndb.IntegerProperty(default=0, indexed=False)
+
+class InterestShard(ndb.Model):
+    """InterestShard -- one slice of a session's wishlist count"""
+    session         = ndb.KeyProperty(kind='Session', indexed=False)
+    conference      = ndb.KeyProperty(kind='Conference')
+    count           = ndb.IntegerProperty(default=0, indexed=False)
+
+class CountedChange(ndb.Model):
+    """CountedChange -- marker for a wishlist change already counted on
+    an InterestShard; child of the shard, keyed by the change id"""
+    # indexed for the prune_counted_changes sweep
+    created         = ndb.DateTimeProperty(auto_now_add=True)
 
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
@@ -107,6 +249,16 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form messages"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class PopularSessionForm(messages.Message):
+    """PopularSessionForm -- a session and the number of wishlists it is on"""
+    session = messages.MessageField(SessionForm, 1)
+    interest = messages.IntegerField(2)
+
+class PopularSessionForms(messages.Message):
+    """PopularSessionForms -- most wishlisted sessions of a conference"""
+    items = messages.MessageField(PopularSessionForm, 1, repeated=True)
 
 class ConferenceTopics(messages.Enum):
     """Topic -- conference type enumeration value."""
@@ -142,6 +294,19 @@ class TeeShirtSize(messages.Enum):
     XXXL_M = 14
     XXXL_W = 15
 
+class AggregateForm(messages.Message):
+    """AggregateForm -- registrations for one city, month or topic"""
+    name = messages.StringField(1)
+    registrations = messages.IntegerField(2)
+
+class ExportReportForm(messages.Message):
+    """ExportReportForm -- registration aggregates of the latest export"""
+    exportId = messages.StringField(1)
+    created = messages.StringField(2)
+    cities = messages.MessageField(AggregateForm, 3, repeated=True)
+    months = messages.MessageField(AggregateForm, 4, repeated=True)
+    topics = messages.MessageField(AggregateForm, 5, repeated=True)
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -151,3 +316,5 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    limit = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
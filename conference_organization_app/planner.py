@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+planner.py -- Udacity conference server-side Python App Engine
+    query planner for user supplied filters
+
+$Id$
+
+Only one filter per query goes to the datastore: the most selective one
+that a composite index in conference.INDEXES covers. The remaining
+filters are checked in memory over a bounded, cursor-paged scan, so any
+combination of filters works without an index per combination.
+
+Run `python planner.py > index.yaml` to regenerate index.yaml from
+conference.INDEXES.
+"""
+
+import operator
+
+PREDICATES = {
+    '=':  operator.eq,
+    '!=': operator.ne,
+    '>':  operator.gt,
+    '>=': operator.ge,
+    '<':  operator.lt,
+    '<=': operator.le,
+}
+
+# entities looked at per page before giving up and returning a cursor
+MAX_SCAN = 500
+
+
+def planFilters(filters, indexed):
+    """Split filters into (datastore_filter, residual_filters).
+
+    indexed lists the fields that have a composite index, most selective
+    first. Equality filters beat inequality filters; "!=" filters never
+    go to the datastore (they would run as two queries). datastore_filter
+    is None if no filter can use an index.
+    """
+    candidates = [f for f in filters
+                  if f['field'] in indexed and f['operator'] != '!=']
+    if not candidates:
+        return None, list(filters)
+
+    best = min(candidates, key=lambda f: (f['operator'] != '=',
+                                          indexed.index(f['field'])))
+    return best, [f for f in filters if f is not best]
+
+
+def planCombination(filters, combinations, sort_field):
+    """Split filters into (datastore_filters, residual_filters) for a
+    query sorted on sort_field.
+
+    combinations lists the sets of equality fields that have a composite
+    index (ending in sort_field), most selective first; the first one all
+    of whose fields are filtered goes to the datastore together with any
+    inequality on sort_field.
+    """
+    equalities = {}
+    for f in filters:
+        if f['operator'] == '=':
+            equalities.setdefault(f['field'], f)
+
+    chosen = []
+    for combination in combinations:
+        if all(field in equalities for field in combination):
+            chosen = [equalities[field] for field in combination]
+            break
+    chosen.extend(f for f in filters
+                  if f['field'] == sort_field and f['operator'] != '!=')
+
+    chosen_ids = set(id(f) for f in chosen)
+    return chosen, [f for f in filters if id(f) not in chosen_ids]
+
+
+def matches(entity, filters):
+    """Return True if entity passes all filters, with datastore semantics
+    for repeated properties (any one value may match)."""
+    for f in filters:
+        test = PREDICATES[f['operator']]
+        value = getattr(entity, f['field'])
+        if isinstance(value, list):
+            if not any(test(v, f['value']) for v in value):
+                return False
+        elif value is None or not test(value, f['value']):
+            return False
+    return True
+
+
+def fetchPage(query, filters, limit, start_cursor=None, max_scan=MAX_SCAN):
+    """Fetch up to limit entities of query that pass filters.
+
+    Returns (results, cursor, more) like Query.fetch_page. At most
+    max_scan entities are read per call, so a page may come back short
+    (even empty) with more=True; the cursor continues the scan.
+    """
+    if not filters:
+        return query.fetch_page(limit, start_cursor=start_cursor)
+
+    results = []
+    scanned = 0
+    it = query.iter(start_cursor=start_cursor, produce_cursors=True,
+                    batch_size=min(max_scan, limit * 4))
+    for entity in it:
+        scanned += 1
+        if matches(entity, filters):
+            results.append(entity)
+        if len(results) == limit or scanned == max_scan:
+            return results, it.cursor_after(), it.has_next()
+    return results, None, False
+
+
+def indexYaml(indexes):
+    """Return index.yaml contents for [(kind, [property, ...]), ...]."""
+    lines = [
+        'indexes:',
+        '',
+        '# Generated by `python planner.py > index.yaml` from',
+        '# conference.INDEXES; edit INDEXES rather than this file.',
+    ]
+    for kind, properties in indexes:
+        lines.extend(['', '- kind: %s' % kind, '  properties:'])
+        lines.extend('  - name: %s' % prop for prop in properties)
+    # the dev server adds indexes for any other query below the marker;
+    # move them into INDEXES
+    lines.extend(['', '# AUTOGENERATED'])
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    import conference
+    print indexYaml(conference.INDEXES),
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+popularity.py -- Udacity conference server-side Python App Engine
+    sharded per-session interest counters, fed by wishlist changes
+
+$Id$
+
+Every session has up to INTEREST_SHARDS InterestShard entities, each in
+its own entity group. A wishlist change adds or takes one from a shard
+of the session picked by the change's random id, so popular sessions
+don't contend on one counter.
+The shards carry their conference, so one query sums up a conference's
+sessions; the sorted totals are cached in memcache for
+POPULAR_CACHE_TIME.
+
+Wishlist transactions call queueCount(), which queues a count_interest
+task as part of the transaction, so a change is counted if and only if
+it commits. The task's change id picks the shard and is stored as a
+CountedChange next to it in the same transaction, so a retried task
+doesn't count a change twice. The tasks run on the count-interest queue,
+which gives up on a task after a day, so a daily cron job deletes the
+markers older than MARKER_TIME.
+"""
+
+import datetime
+import uuid
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import CountedChange
+from models import InterestShard
+
+INTEREST_SHARDS = 5
+MEMCACHE_POPULAR_KEY = "POPULAR SESSIONS: %s"
+POPULAR_CACHE_TIME = 60
+COUNT_QUEUE = 'count-interest'
+# longer than the task_age_limit of COUNT_QUEUE (queue.yaml)
+MARKER_TIME = datetime.timedelta(days=2)
+PRUNE_BATCH = 500
+
+
+@ndb.transactional_tasklet
+def _addToShardAsync(sess_key, delta, change_id):
+    shard_key = ndb.Key(InterestShard, '%s-%d' % (
+        sess_key.urlsafe(), zlib.crc32(change_id) % INTEREST_SHARDS))
+    marker_key = ndb.Key(CountedChange, change_id, parent=shard_key)
+    shard, marker = yield ndb.get_multi_async([shard_key, marker_key])
+    if marker:
+        # a retry of a task that already got this far
+        return
+    if not shard:
+        shard = InterestShard(key=shard_key, session=sess_key,
+                              conference=sess_key.parent())
+    shard.count += delta
+    yield ndb.put_multi_async([shard, CountedChange(key=marker_key)])
+
+
+def queueCount(added=(), removed=()):
+    """Queue the counting of sessions added to (and removed from) a
+    wishlist; part of the current transaction, if any."""
+    if not (added or removed):
+        return
+    taskqueue.add(params={'changeId': uuid.uuid4().hex,
+                          'added': [key.urlsafe() for key in added],
+                          'removed': [key.urlsafe() for key in removed]},
+                  url='/tasks/count_interest',
+                  queue_name=COUNT_QUEUE,
+                  transactional=ndb.in_transaction())
+
+
+def countInterest(change_id, added=(), removed=()):
+    """Count sessions added to (and removed from) a wishlist, once per
+    change_id."""
+    futures = ([_addToShardAsync(key, 1, change_id) for key in added] +
+               [_addToShardAsync(key, -1, change_id) for key in removed])
+    for future in futures:
+        future.get_result()
+
+
+def pruneCountedChanges():
+    """Delete PRUNE_BATCH CountedChange markers older than MARKER_TIME;
+    no task that could still be retried needs them. Queues itself while
+    there are more."""
+    cutoff = datetime.datetime.now() - MARKER_TIME
+    keys = CountedChange.query(CountedChange.created < cutoff).fetch(
+        PRUNE_BATCH, keys_only=True)
+    ndb.delete_multi(keys)
+    if len(keys) == PRUNE_BATCH:
+        taskqueue.add(url='/tasks/prune_counted_changes')
+
+
+def rankSessions(conf_key):
+    """Return [(session_key, interest), ...] of a conference, most
+    wishlisted first, from memcache when possible."""
+    cache_key = MEMCACHE_POPULAR_KEY % conf_key.urlsafe()
+    ranking = memcache.get(cache_key)
+    if ranking is None:
+        totals = {}
+        for shard in InterestShard.query(InterestShard.conference == conf_key):
+            totals[shard.session] = totals.get(shard.session, 0) + shard.count
+        ranking = sorted(((key, count) for key, count in totals.items()
+                          if count > 0),
+                         key=lambda item: (-item[1], item[0].id()))
+        memcache.set(cache_key, ranking, time=POPULAR_CACHE_TIME)
+    return ranking
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+seats.py -- Udacity conference server-side Python App Engine
+    sharded seat counters for conference registration
+
+$Id$
+
+A conference's seats are split across SeatShard entities, each in its
+own entity group. A registration takes one seat from one shard in a
+transaction, so registrations for the same conference no longer contend
+on the Conference entity. A shard never goes below zero, so the sum over
+shards never oversells. Conference.seatsAvailable is a copy of that sum,
+refreshed by a coalesced sync_seats task. Once the shards exist, a change
+of maxAttendees is added to them by resizeShards().
+"""
+
+from google.appengine.ext import ndb
+
+from models import SeatShard
+from utils import addCoalescedTask
+
+import cache
+
+SEAT_SHARDS = 20
+SYNC_SEATS_INTERVAL = 5
+
+
+def _shardKeys(conf_key, num_shards):
+    """Return the SeatShard keys of a conference."""
+    return [ndb.Key(SeatShard, '%s-%d' % (conf_key.urlsafe(), i))
+            for i in range(num_shards)]
+
+
+@ndb.transactional(xg=True)
+def _createShards(conf_key):
+    """Split the conference's seatsAvailable over new SeatShards."""
+    conf = conf_key.get()
+    if conf.seatShards:
+        # another request got here first
+        return conf.seatShards
+
+    seats = max(conf.seatsAvailable or 0, 0)
+    num_shards = max(1, min(SEAT_SHARDS, seats))
+    shards = []
+    for i, key in enumerate(_shardKeys(conf_key, num_shards)):
+        # spread seats as evenly as possible
+        shard_seats = seats // num_shards + (1 if i < seats % num_shards else 0)
+        shards.append(SeatShard(key=key, conference=conf_key,
+                                seatsAvailable=shard_seats))
+
+    conf.seatShards = num_shards
+    ndb.put_multi(shards + [conf])
+    cache.invalidate(conf_key)
+    return num_shards
+
+
+def getShardKeys(conf):
+    """Return the SeatShard keys of a conference, creating the shards the
+    first time somebody registers for it.
+    """
+    num_shards = conf.seatShards or _createShards(conf.key)
+    return _shardKeys(conf.key, num_shards)
+
+
+def countShardSeats(shard_keys):
+    """Return the number of seats left on the given shards."""
+    shards = ndb.get_multi(shard_keys)
+    return sum(shard.seatsAvailable for shard in shards if shard)
+
+
+def countSeats(conf):
+    """Return the number of seats left across all shards."""
+    if not conf.seatShards:
+        return conf.seatsAvailable
+    return countShardSeats(_shardKeys(conf.key, conf.seatShards))
+
+
+def resizeShards(conf, max_attendees):
+    """Add the change in maxAttendees to the free seats on the shards.
+
+    Run it in an xg transaction that also puts conf (SEAT_SHARDS + 1
+    entity groups, within the limit of 25); it sets conf's maxAttendees
+    and seatsAvailable and returns the seats left. Raises ValueError if
+    fewer seats are free than are being taken away.
+    """
+    shards = ndb.get_multi(_shardKeys(conf.key, conf.seatShards))
+    seats = sum(shard.seatsAvailable for shard in shards)
+    delta = max_attendees - (conf.maxAttendees or 0)
+    if seats + delta < 0:
+        raise ValueError('maxAttendees can be lowered by at most %d, '
+                         'the number of free seats' % seats)
+
+    if delta > 0:
+        # spread the new seats as evenly as possible
+        for i, shard in enumerate(shards):
+            shard.seatsAvailable += (delta // len(shards) +
+                                     (1 if i < delta % len(shards) else 0))
+    else:
+        # take the seats from the fullest shards first
+        remove = -delta
+        for shard in sorted(shards, key=lambda shard: -shard.seatsAvailable):
+            taken = min(shard.seatsAvailable, remove)
+            shard.seatsAvailable -= taken
+            remove -= taken
+    if delta:
+        ndb.put_multi(shards)
+
+    conf.maxAttendees = max_attendees
+    conf.seatsAvailable = seats + delta
+    return conf.seatsAvailable
+
+
+def scheduleSync(conf_key):
+    """Queue a sync_seats task for the conference; a burst of
+    registrations within SYNC_SEATS_INTERVAL queues a single task.
+    """
+    addCoalescedTask('sync-seats-%s' % conf_key.urlsafe(), '/tasks/sync_seats',
+                     {'websafeConferenceKey': conf_key.urlsafe()},
+                     SYNC_SEATS_INTERVAL)
+
+
+@ndb.transactional()
+def _setSeatsAvailable(conf_key, seats):
+    conf = conf_key.get()
+    if conf and conf.seatsAvailable != seats:
+        conf.seatsAvailable = seats
+        conf.put()
+        cache.invalidate(conf_key)
+    return conf
+
+
+def syncSeats(websafeConferenceKey):
+    """Copy the shard total onto Conference.seatsAvailable."""
+    conf_key = ndb.Key(urlsafe=websafeConferenceKey)
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return None
+    return _setSeatsAvailable(conf_key, countSeats(conf))
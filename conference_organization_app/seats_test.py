@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Test cases for seats.py and conference registration
+#
+# Run from this directory with the App Engine SDK on the Python path:
+#
+#     python seats_test.py
+#
+# Every test runs against fresh local datastore & memcache stubs.
+
+import endpoints
+from google.appengine.ext import ndb
+
+from models import ConflictException
+from models import Conference
+from models import ConferenceForm
+
+from loadtest import setUpTestbed, setUser
+
+import conference
+import seats
+
+ORGANIZER = 'organizer@example.com'
+CONF_REQUEST = conference.CONFERENCE_GET_REQUEST.combined_message_class
+UPDATE_REQUEST = conference.CONF_POST_REQUEST.combined_message_class
+
+
+def newConference(api, max_attendees):
+    setUser(ORGANIZER)
+    form = api.createConference(ConferenceForm(
+        name='Conference', city='London', maxAttendees=max_attendees))
+    return Conference.query(Conference.name == form.name).get().key
+
+def register(api, conf_key, users, first=0):
+    """Register users first.. first+users-1; return how many got a seat."""
+    registered = 0
+    for i in range(first, first + users):
+        setUser('user%d@example.com' % i)
+        try:
+            api.registerForConference(
+                CONF_REQUEST(websafeConferenceKey=conf_key.urlsafe()))
+        except ConflictException:
+            continue
+        registered += 1
+    return registered
+
+def updateConference(api, conf_key, **fields):
+    setUser(ORGANIZER)
+    return api.updateConference(
+        UPDATE_REQUEST(websafeConferenceKey=conf_key.urlsafe(), **fields))
+
+def shardSeats(conf_key):
+    conf = conf_key.get(use_cache=False)
+    return [shard.seatsAvailable for shard in
+            ndb.get_multi(seats._shardKeys(conf_key, conf.seatShards))]
+
+def testNoOversell():
+    api = conference.ConferenceApi()
+    conf_key = newConference(api, 30)
+    registered = register(api, conf_key, 40)
+    if registered != 30:
+        raise ValueError("30 seats should take 30 users, not %s." % registered)
+    if conf_key.get().seatShards != seats.SEAT_SHARDS:
+        raise ValueError("The seats should be spread over %d shards." %
+                         seats.SEAT_SHARDS)
+    if any(shardSeats(conf_key)):
+        raise ValueError("Every shard should be sold out: %s" %
+                         shardSeats(conf_key))
+    print "1. Registering past capacity across shards doesn't oversell."
+
+def testGrowMaxAttendees():
+    api = conference.ConferenceApi()
+    conf_key = newConference(api, 30)
+    register(api, conf_key, 30)
+    form = updateConference(api, conf_key, maxAttendees=35)
+    if form.maxAttendees != 35 or form.seatsAvailable != 5:
+        raise ValueError("5 new seats should be free, not %s." %
+                         form.seatsAvailable)
+    registered = register(api, conf_key, 10, first=30)
+    if registered != 5:
+        raise ValueError("5 new seats should take 5 users, not %s." %
+                         registered)
+    print "2. Raising maxAttendees adds seats to the shards."
+
+def testShrinkMaxAttendees():
+    api = conference.ConferenceApi()
+    conf_key = newConference(api, 30)
+    register(api, conf_key, 20)
+    form = updateConference(api, conf_key, maxAttendees=25)
+    if form.seatsAvailable != 5 or sum(shardSeats(conf_key)) != 5:
+        raise ValueError("5 seats should be left, not %s." % shardSeats(conf_key))
+    try:
+        updateConference(api, conf_key, maxAttendees=15)
+    except endpoints.BadRequestException:
+        pass
+    else:
+        raise ValueError("maxAttendees can't go below the seats taken.")
+    try:
+        updateConference(api, conf_key, seatsAvailable=100)
+    except endpoints.BadRequestException:
+        pass
+    else:
+        raise ValueError("seatsAvailable can't be set on sharded seats.")
+    conf = conf_key.get(use_cache=False)
+    if conf.maxAttendees != 25 or sum(shardSeats(conf_key)) != 5:
+        raise ValueError("A rejected update shouldn't change the seats.")
+    if register(api, conf_key, 10, first=20) != 5:
+        raise ValueError("Only the 5 seats left should be taken.")
+    print "3. Lowering maxAttendees takes free seats, never taken ones."
+
+if __name__ == '__main__':
+    for test in [testNoOversell, testGrowMaxAttendees, testShrinkMaxAttendees]:
+        tb = setUpTestbed()
+        try:
+            test()
+        finally:
+            tb.deactivate()
+    print "Success!  All tests pass!"
@@ -414,6 +414,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.nextPageToken = null;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -423,13 +424,51 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Fetches the next page of conferences of the selected tab and appends it to $scope.conferences.
+     */
+    $scope.loadMoreConferences = function () {
+        if (!$scope.nextPageToken) {
+            return;
+        }
+        if ($scope.selectedTab == 'ALL') {
+            $scope.queryConferencesAll($scope.nextPageToken);
+        } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
+            $scope.getConferencesCreated($scope.nextPageToken);
+        } else if ($scope.selectedTab == 'YOU_WILL_ATTEND') {
+            $scope.getConferencesAttend($scope.nextPageToken);
+        }
+    };
+
+    /**
+     * Sets the conferences of a page in the $scope.
+     * The first page replaces $scope.conferences, the following pages are appended to it.
+     *
+     * @param resp the response of the API
+     * @param pageToken the token the page was requested with, if it isn't the first page
+     */
+    var showPage = function (resp, pageToken) {
+        if (!pageToken) {
+            $scope.conferences = [];
+        }
+        angular.forEach(resp.items, function (conference) {
+            $scope.conferences.push(conference);
+        });
+        $scope.nextPageToken = resp.nextPageToken || null;
+    };
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param pageToken the nextPageToken of the previous page, to get the next page
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (pageToken) {
         var sendFilters = {
             filters: []
         }
+        if (pageToken) {
+            sendFilters.pageToken = pageToken;
+        }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
             if (filter.field && filter.operator && filter.value) {
@@ -458,10 +497,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
+                        showPage(resp, pageToken);
                     }
                     $scope.submitted = true;
                 });
@@ -470,10 +506,12 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     /**
      * Invokes the conference.getConferencesCreated method.
+     *
+     * @param pageToken the nextPageToken of the previous page, to get the next page
      */
-    $scope.getConferencesCreated = function () {
+    $scope.getConferencesCreated = function (pageToken) {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        gapi.client.conference.getConferencesCreated(pageToken ? {pageToken: pageToken} : {}).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -495,10 +533,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
+                        showPage(resp, pageToken);
                     }
                     $scope.submitted = true;
                 });
@@ -508,10 +543,12 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     /**
      * Retrieves the conferences to attend by calling the conference.getProfile method and
      * invokes the conference.getConference method n times where n == the number of the conferences to attend.
+     *
+     * @param pageToken the nextPageToken of the previous page, to get the next page
      */
-    $scope.getConferencesAttend = function () {
+    $scope.getConferencesAttend = function (pageToken) {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
+        gapi.client.conference.getConferencesToAttend(pageToken ? {pageToken: pageToken} : {}).
             execute(function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
@@ -527,7 +564,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         }
                     } else {
                         // The request has succeeded.
-                        $scope.conferences = resp.result.items;
+                        showPage(resp.result, pageToken);
                         $scope.loading = false;
                         $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
                         $scope.alertStatus = 'success';
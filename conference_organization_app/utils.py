@@ -1,10 +1,121 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.api import urlfetch
-from models import Profile
+from models import CustomUserId
+
+USER_ID_CACHE_KEY = "USER ID: %s"
+USER_ID_LOCK_KEY = "USER ID LOCK: %s"
+MAX_USER_ID_TTL = 60 * 60
+LOOKUP_LOCK_TIME = 10
+LOOKUP_WAIT = 5
+MAX_CACHED_TOKENS = 1000
+
+# token hash -> (user_id, expires_at), shared by the threads of an instance
+_user_ids = {}
+_lookup_locks = {}
+_lock = threading.Lock()
+
+
+def _cachedUserId(token_hash):
+    """Return the user id cached for a token, in process or in memcache."""
+    now = time.time()
+    entry = _user_ids.get(token_hash)
+    if entry and entry[1] > now:
+        return entry[0]
+    entry = memcache.get(USER_ID_CACHE_KEY % token_hash)
+    if entry and entry[1] > now:
+        _rememberUserId(token_hash, entry)
+        return entry[0]
+    return None
+
+
+def _rememberUserId(token_hash, entry):
+    with _lock:
+        if len(_user_ids) >= MAX_CACHED_TOKENS:
+            _user_ids.clear()
+        _user_ids[token_hash] = entry
+
+
+def _lookupLock(token_hash):
+    """Return the lock the threads looking up a token share."""
+    with _lock:
+        if len(_lookup_locks) >= MAX_CACHED_TOKENS:
+            _lookup_locks.clear()
+        return _lookup_locks.setdefault(token_hash, threading.Lock())
+
+
+def _fetchTokenInfo(token):
+    """Ask the tokeninfo endpoint about an OAuth token."""
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+           % (token_type, token))
+    wait = 1
+    for i in range(3):
+        resp = urlfetch.fetch(url)
+        if resp.status_code == 200:
+            return json.loads(resp.content)
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+                   % ('access_token', token))
+        else:
+            time.sleep(wait)
+            wait = wait + i
+    return {}
+
+
+def _oauthUserId(token):
+    """Return the user id of an OAuth token.
+
+    The answer is cached in process and in memcache until the token
+    expires (at most MAX_USER_ID_TTL). Threads of an instance wait for
+    each other's lookup of the same token, and a memcache lock makes
+    other instances wait for it too (up to LOOKUP_WAIT seconds).
+    """
+    token_hash = hashlib.sha1(token).hexdigest()
+    user_id = _cachedUserId(token_hash)
+    if user_id:
+        return user_id
+
+    with _lookupLock(token_hash):
+        user_id = _cachedUserId(token_hash)
+        if user_id:
+            return user_id
+
+        lock_key = USER_ID_LOCK_KEY % token_hash
+        lock_id = uuid.uuid4().hex
+        locked = memcache.add(lock_key, lock_id, time=LOOKUP_LOCK_TIME)
+        if not locked:
+            # another instance is looking it up
+            deadline = time.time() + LOOKUP_WAIT
+            while time.time() < deadline:
+                time.sleep(0.1)
+                user_id = _cachedUserId(token_hash)
+                if user_id:
+                    return user_id
+        try:
+            user = _fetchTokenInfo(token)
+            user_id = user.get('user_id', '')
+            ttl = min(int(user.get('expires_in', 0)), MAX_USER_ID_TTL)
+            if user_id and ttl > 0:
+                entry = (user_id, time.time() + ttl)
+                memcache.set(USER_ID_CACHE_KEY % token_hash, entry, time=ttl)
+                _rememberUserId(token_hash, entry)
+        finally:
+            # only release our own lock, not one another instance took
+            # after ours expired or while we waited
+            if locked and memcache.get(lock_key) == lock_id:
+                memcache.delete(lock_key)
+        return user_id
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -14,32 +125,34 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _oauthUserId(token)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
-        # this is just a sample that queries datastore for an existing profile
-        # and generates an id if profile does not exist for an email
-        profile = Conference.query(Conference.mainEmail == user.email())
-        if profile:
-            return profile.id()
-        else:
-            return str(uuid.uuid1().get_hex())
+        # this is just a sample that looks up the id stored for an email
+        # and generates one the first time the email is seen
+        custom = CustomUserId.get_by_id(user.email())
+        if not custom:
+            custom = CustomUserId.get_or_insert(
+                user.email(), userId=str(uuid.uuid1().get_hex()))
+        return custom.userId
+
+def addCoalescedTask(name, url, params, interval):
+    """Add a push task at most once per `interval` seconds for `name`.
+
+    The task is named after the current time window and runs after the
+    window closes, so every caller within the window is covered by it.
+    Returns True if this call added the task.
+    """
+    now = int(time.time())
+    window = now // interval
+    try:
+        taskqueue.add(
+            name='%s-%d' % (name, window),
+            params=params,
+            url=url,
+            countdown=(window + 1) * interval - now + 1,
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        return False
+    return True
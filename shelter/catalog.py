@@ -0,0 +1,101 @@
+# Puppy listings and search
+#
+# A listing loads the puppies with their shelter and profile joined in
+# the same query, and the adopters of the whole page in one more query
+# (selectinload), so showing a page takes the same number of queries
+# however many puppies are on it.
+#
+# Search results are paginated by key: the next page starts after the
+# (sort value, id) of the last puppy shown instead of at an offset, so
+# with the indexes declared on Puppy every page costs the same however
+# deep it is.
+import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload, selectinload
+from puppies import Puppy, Profile, Adopter
+
+PAGE_SIZE = 20
+
+# Orders of search results: (sort column, descending)
+# The id breaks ties
+ORDERS = {
+	'youngest': (Puppy.dateOfBirth, True),
+	'oldest': (Puppy.dateOfBirth, False),
+	'lightest': (Puppy.weight, False),
+	'heaviest': (Puppy.weight, True),
+}
+
+# Loader options for puppies that are listed with their shelter,
+# profile and adopters
+def PuppyListingOptions():
+	return (joinedload(Puppy.shelter), joinedload(Puppy.profile),
+		selectinload(Puppy.adopters))
+
+# Return the puppies, ordered by id, with their shelter, profile and
+# adopters loaded
+# Only the puppies of shelter_id if given
+def ListPuppies(session, shelter_id=None, limit=None, offset=0):
+	puppies = session.query(Puppy).options(*PuppyListingOptions())
+	if shelter_id is not None:
+		puppies = puppies.filter(Puppy.shelter_id == shelter_id)
+	return puppies.order_by(Puppy.id).offset(offset).limit(limit).all()
+
+# Return the adopters, ordered by id, with the puppies they adopted
+# and those puppies' profiles loaded
+def ListAdopters(session):
+	return session.query(Adopter).options(
+		selectinload(Adopter.puppies).joinedload(Puppy.profile)).\
+		order_by(Adopter.id).all()
+
+# Search the puppies
+# Ages are in days, counted back from today (the current date by
+# default); puppies without a date of birth (or weight) are left out of
+# an age (or weight) search and of results sorted by it
+# Pass the key returned with a page as after to get the next page
+# Returns (puppies, key of the next page or None if this is the last)
+def SearchPuppies(session, min_age=None, max_age=None, min_weight=None,
+		max_weight=None, gender=None, shelter_id=None, special_needs=None,
+		order='youngest', after=None, limit=PAGE_SIZE, today=None):
+	if order not in ORDERS:
+		raise ValueError("Puppies can't be ordered by %s" % order)
+	column, descending = ORDERS[order]
+	today = today or datetime.date.today()
+
+	puppies = session.query(Puppy).options(*PuppyListingOptions()).\
+		filter(column != None)
+	if min_age is not None:
+		puppies = puppies.filter(Puppy.dateOfBirth <= today - datetime.timedelta(days = min_age))
+	if max_age is not None:
+		puppies = puppies.filter(Puppy.dateOfBirth > today - datetime.timedelta(days = max_age))
+	if min_weight is not None:
+		puppies = puppies.filter(Puppy.weight >= min_weight)
+	if max_weight is not None:
+		puppies = puppies.filter(Puppy.weight <= max_weight)
+	if gender is not None:
+		puppies = puppies.filter(Puppy.gender == gender)
+	if shelter_id is not None:
+		puppies = puppies.filter(Puppy.shelter_id == shelter_id)
+	if special_needs is not None:
+		puppies = puppies.filter(Puppy.profile.has(Profile.special_needs == special_needs))
+
+	if after is not None:
+		value, puppy_id = after
+		if descending:
+			puppies = puppies.filter(or_(column < value,
+				and_(column == value, Puppy.id < puppy_id)))
+		else:
+			puppies = puppies.filter(or_(column > value,
+				and_(column == value, Puppy.id > puppy_id)))
+	if descending:
+		puppies = puppies.order_by(column.desc(), Puppy.id.desc())
+	else:
+		puppies = puppies.order_by(column, Puppy.id)
+
+	if limit is None:
+		return puppies.all(), None
+	# One more puppy tells whether there is a next page
+	puppies = puppies.limit(limit + 1).all()
+	if len(puppies) <= limit:
+		return puppies, None
+	last = puppies[limit - 1]
+	return puppies[:limit], (getattr(last, column.key), last.id)
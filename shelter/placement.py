@@ -0,0 +1,57 @@
+# Capacity-aware placement of new puppies in shelters
+#
+# Shelters are kept in a priority queue (heapq) ordered by spare room
+# (max_capacity - current_occupancy), or by distance first when a zip
+# code is given. Placing n puppies is one query for the shelters plus
+# O(n log s) heap operations; no puppies are counted.
+import heapq
+from puppies import Shelter
+
+# Rough distance between two zip codes; shelters with a missing or
+# malformed zip code come last
+def ZipDistance(zip1, zip2):
+	try:
+		return abs(int(zip1[:5]) - int(zip2[:5]))
+	except (TypeError, ValueError):
+		return float('inf')
+
+# Build the heap of shelters that have room left
+# Heap entries are (distance, -spare room, shelter id)
+def ShelterHeap(session, zipCode=None):
+	heap = []
+	for shelter_id, max_capacity, occupancy, shelter_zip in session.query(
+			Shelter.id, Shelter.max_capacity, Shelter.current_occupancy,
+			Shelter.zipCode):
+		spare = (max_capacity or 0) - (occupancy or 0)
+		if spare > 0:
+			distance = ZipDistance(zipCode, shelter_zip) if zipCode else 0
+			heap.append((distance, -spare, shelter_id))
+	heapq.heapify(heap)
+	return heap
+
+# Assign shelters to new puppies (not yet added to the session)
+# The shelter with the most room left (the nearest one if zipCode is
+# given) is picked for each puppy in turn
+# Raises ValueError, without adding any puppy, if they don't all fit
+# Returns the shelter ids in the order of the puppies
+def PlacePuppies(session, puppies, zipCode=None):
+	heap = ShelterHeap(session, zipCode)
+	shelter_ids = []
+	for puppy in puppies:
+		if not heap:
+			raise ValueError("There is no room left for %s of the %s puppies" %
+				(len(puppies) - len(shelter_ids), len(puppies)))
+		distance, spare, shelter_id = heapq.heappop(heap)
+		shelter_ids.append(shelter_id)
+		if spare < -1:
+			heapq.heappush(heap, (distance, spare + 1, shelter_id))
+
+	for puppy, shelter_id in zip(puppies, shelter_ids):
+		puppy.shelter_id = shelter_id
+	session.add_all(puppies)
+	session.commit()
+	return shelter_ids
+
+# Place a single new puppy; returns its shelter id
+def PlacePuppy(session, puppy, zipCode=None):
+	return PlacePuppies(session, [puppy], zipCode)[0]
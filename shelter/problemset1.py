@@ -13,6 +13,9 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import select
 from sqlalchemy import func
 from puppies import Base, Shelter, Puppy, Profile, Adopter
+from placement import PlacePuppy
+from shelterservice import AdoptPuppies
+from catalog import SearchPuppies
 engine = create_engine('sqlite:///puppyshelter.db')
 Base.metadata.bind = engine
 DBSession = sessionmaker(bind = engine)
@@ -44,26 +47,32 @@ def exercise2():
 	## youngest first
 	########################################
 
-	# Get current date and subtract 6 months
-	date = datetime.date.today() - datetime.timedelta(days = 182.5)
-	# Select all the puppies that are less than 6 month old
-	# ordered by the youngest first
-	puppies = session.query(Puppy.name, Puppy.dateOfBirth).filter(Puppy.dateOfBirth > date).\
-			  order_by(Puppy.dateOfBirth.desc()).all()
-	# Print all the puppies
-	for puppy in puppies:
-		print puppy
+	# Select the puppies that are less than 6 months (182.5 days) old
+	# ordered by the youngest first, a page at a time
+	after = None
+	while True:
+		puppies, after = SearchPuppies(session, max_age = 182.5, after = after)
+		# Print the puppies on this page
+		for puppy in puppies:
+			print puppy.name, puppy.dateOfBirth
+		if after is None:
+			break
 
 	########################################
 	## Question 3
 	## Query all puppies by ascending weight
 	########################################
 
-	# Select all the puppies ordered by their weight in ascending order
-	puppies = session.query(Puppy.name, Puppy.weight).order_by(Puppy.weight.asc()).all()
-	# Print all the puppies
-	for puppy in puppies:
-		print puppy
+	# Select all the puppies ordered by their weight in ascending order,
+	# a page at a time
+	after = None
+	while True:
+		puppies, after = SearchPuppies(session, order = 'lightest', after = after)
+		# Print the puppies on this page
+		for puppy in puppies:
+			print puppy.name, puppy.weight
+		if after is None:
+			break
 
 	########################################
 	## Question 4
@@ -112,12 +121,11 @@ def exercise4():
 		print "Maximum capacity of shelter (%s) is %s" % (shelter[0], shelter[1])
 
 	# Return number of puppies that are not adopted
-	puppies = session.query(func.count(Puppy.name), Shelter.name).\
-			  join(Shelter).filter(Puppy.shelter_id==Shelter.id).\
-			  group_by(Shelter.name).order_by(Shelter.id).all()
-	# Print puppies and their adopter
-	for puppy in puppies:
-		print "Current occupancy of shelter %s is %s" %(puppy[1], puppy[0])
+	# (kept up to date by triggers, see puppies.py)
+	shelters = session.query(Shelter.name, Shelter.current_occupancy).order_by(Shelter.id).all()
+	# Print the occupancy of every shelter
+	for shelter in shelters:
+		print "Current occupancy of shelter %s is %s" %(shelter[0], shelter[1])
 
 ########################################
 ########################################
@@ -137,7 +145,7 @@ def exercise5():
 
 	# This method will create a random weight between 1.0-40.0 pounds (or whatever unit of measure you prefer)
 	def CreateRandomWeight():
-		return random.uniform(1.0, 40.0)
+		return round(random.uniform(1.0, 40.0), 2)
 
 	# Return all shelters and their id
 	shelters = session.query(Shelter.id, Shelter.name).all()
@@ -179,21 +187,15 @@ def exercise5():
 					puppy_confirm = raw_input("Wrong input! Please type Y(for Yes) or N(for No) ")
 					check = 0
 
-		# Count puppies in each shelter
-		puppies = session.query(func.count(Puppy.name), Shelter.name).\
-			join(Shelter).filter(Puppy.shelter_id==Shelter.id).\
-			group_by(Shelter.name).order_by(Shelter.id).all()
-
-	    # Check max capacity for the shelter
-	    # that the user has selected
-	  	check_max_capacity = session.query(Shelter.id, Shelter.name, Shelter.max_capacity).order_by(Shelter.id).all()
-	  	shelter_max_capacity = check_max_capacity[puppy_shelter-1].max_capacity
+		# Look up the occupancy and max capacity of
+		# the shelter that the user has selected
+		shelter = session.query(Shelter).filter_by(id=puppy_shelter).one()
 
 		# Check if current occupancy is less than
 		# the max capacity and if yes add the new
 		# puppy in the shelter if not prompt user
 		# to select a different shelter
-		if puppies[puppy_shelter-1][0] < 20:
+		if (shelter.current_occupancy or 0) < shelter.max_capacity:
 			# Adds the new puppy in the
 			# shelter the user specified
 			new_puppy = Puppy(name = puppy_name, gender = puppy_gender, dateOfBirth = CreateRandomAge(),picture=random.choice(puppy_images) ,shelter_id=puppy_shelter, weight= CreateRandomWeight())
@@ -203,17 +205,13 @@ def exercise5():
 
 			# Check current occupancy of the shelter
 			# that user has selected
-			puppies = session.query(func.count(Puppy.name), Shelter.name).\
-		    	join(Shelter).filter(Puppy.shelter_id==Shelter.id).\
-				group_by(Shelter.name).order_by(Shelter.id).all()
-			print "There are %s puppies in the %s shelter after the adition of your puppy %s" %(puppies[puppy_shelter-1][0], puppies[puppy_shelter-1].name, puppy_name)
+			session.refresh(shelter)
+			print "There are %s puppies in the %s shelter after the adition of your puppy %s" %(shelter.current_occupancy, shelter.name, puppy_name)
 		else:
 			print "The shelter you selected is full. Please select a different shelter or let the system select a shelter for you"
 
 			select_new_shelter = raw_input("Type Y(to secect a different shelter), N(to exit the selection) or A(to auto select) ")
 			check = 0
-			# Exits the loop if there are no vacancies in any shelter
-			commited = 0
 			while check == 0:
 				if select_new_shelter == "Y":
 					reset = 0
@@ -222,47 +220,26 @@ def exercise5():
 					reset = 1
 					check = 1
 				elif select_new_shelter == "A":
-					# Check if there are vacancies in other
-					# shelters and add the puppy there
-					puppies = session.query(func.count(Puppy.name), Shelter.name, Shelter.id).\
-		  				join(Shelter).filter(Puppy.shelter_id==Shelter.id).\
-				  		group_by(Shelter.name).order_by(Shelter.id).all()
-
-			  		# Adds the puppy in a random
-			  		# shelter (if there are any vacancies)
-		  			for puppy in puppies:
-		  				if puppy[0] < 20:
-		  					# Adds the new puppy in the
-							# shelter the user specified
-							new_puppy = Puppy(name = puppy_name, gender = puppy_gender, dateOfBirth = CreateRandomAge(),picture=random.choice(puppy_images),shelter_id=puppy[2], weight= CreateRandomWeight())
-							session.add(new_puppy)
-							session.commit()
-							reset = 1
-							check = 1
-							commited = 1
-							# Check current occupancy of the shelter
-							# that the system has selected
-							puppies = session.query(func.count(Puppy.name), Shelter.name, Shelter.id).\
-								join(Shelter).filter(Puppy.shelter_id==Shelter.id).\
-	  							group_by(Shelter.name).order_by(Shelter.id).all()
-							print "There are %s puppies in the %s shelter after the adition of your puppy %s" %(puppy[0]+1, puppy[1], puppy_name)
-							# Breaks the for loop
-							break
+					# Let the placement engine add the puppy
+					# in the shelter with the most room left
+					new_puppy = Puppy(name = puppy_name, gender = puppy_gender, dateOfBirth = CreateRandomAge(),picture=random.choice(puppy_images), weight= CreateRandomWeight())
+					try:
+						shelter = session.query(Shelter).get(PlacePuppy(session, new_puppy))
+						print "There are %s puppies in the %s shelter after the adition of your puppy %s" %(shelter.current_occupancy, shelter.name, puppy_name)
+					except ValueError:
+						# Exits the loop if there are no vacancies in any shelter
+						print "There are no empty shelters this time. Please be patient as new shelters will open."
+					reset = 1
+					check = 1
 				else:
 					select_new_shelter = raw_input("Wrong input! Please type Y(to secect a different shelter), N(to exit the selection) or A(to auto select) ")
 					check = 0
 
-				if commited == 0:
-					print "There are no empty shelters this time. Please be patient as new shelters will open."
-					reset = 1
-					check = 1
-
-		puppies = session.query(func.count(Puppy.name), Shelter.name, Shelter.id).\
-			join(Shelter).filter(Puppy.shelter_id==Shelter.id).\
-	  		group_by(Shelter.name).order_by(Shelter.id).all()
+		shelters = session.query(Shelter.current_occupancy, Shelter.name, Shelter.id).\
+			order_by(Shelter.id).all()
 
-		for puppy in puppies:
-			print puppy
+		for shelter in shelters:
+			print shelter
 
 ########################################
 ########################################
@@ -275,12 +252,13 @@ def exercise5():
 # Can also take an array of
 # adopter ids
 def AdoptPuppy(puppy_id,adopters_id):
-	puppies = session.query(Puppy).filter_by(id=puppy_id).all()
-
-	for puppy in puppies:
-		puppy.adopter_id = adopters_id
-		puppy.shelter_id = 0
-		session.commit()
+	if not isinstance(adopters_id, (list, tuple)):
+		adopters_id = [adopters_id]
+	puppy = session.query(Puppy).get(int(puppy_id))
+	# Adds the adopters and takes the puppy out of its shelter
+	if puppy is None or not AdoptPuppies(session, [(puppy.id, adopters_id)]):
+		print "Puppy %s is not up for adoption" % puppy_id
+		return
 
 	print "Congratulations %s for adopting %s" %(adopters_name, puppy.name)
 
@@ -1,13 +1,15 @@
-from sqlalchemy import Table, Column, ForeignKey, Integer, String, Date, Numeric
+from sqlalchemy import Table, Column, ForeignKey, Index, Integer, String, Date, Numeric
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import create_engine
  
 Base = declarative_base()
 
+# An adoption; a puppy can be adopted by more than one adopter
 adopt_puppy = Table('adopt_puppy', Base.metadata,
-    Column('puppy_id', Integer, ForeignKey('puppies.id')),
-    Column('adopter_id', Integer, ForeignKey('adopters.id'))
+    Column('puppy_id', Integer, ForeignKey('puppies.id'), primary_key=True),
+    Column('adopter_id', Integer, ForeignKey('adopters.id'), primary_key=True,
+           index=True)
 )
 
 class Shelter(Base):
@@ -32,17 +34,28 @@ class Puppy(Base):
     gender = Column(String(6), nullable = False)
     dateOfBirth = Column(Date)
     picture = Column(String)
-    shelter_id = Column(Integer, ForeignKey('shelter.id'))
+    shelter_id = Column(Integer, ForeignKey('shelter.id'), index=True)
     shelter = relationship(Shelter)
-    weight = Column(Numeric(10))
-    profile = relationship("Profile", uselist=False, backref="puppies")
-    adopter_id = Column(Integer, ForeignKey('adopters.id'))
-    adopter = relationship("Adopter", secondary=adopt_puppy, backref="puppies")
+    # Up to 999.99
+    weight = Column(Numeric(5, 2))
+    profile = relationship("Profile", uselist=False, back_populates="puppy")
+    adopters = relationship("Adopter", secondary=adopt_puppy,
+                            back_populates="puppies")
+
+    # Indexes for searching puppies (see catalog.py); they end with the
+    # id, so keyset pagination can start from any puppy
+    __table_args__ = (
+        Index('ix_puppies_age', 'dateOfBirth', 'id'),
+        Index('ix_puppies_weight', 'weight', 'id'),
+        Index('ix_puppies_gender_age', 'gender', 'dateOfBirth', 'id'),
+        Index('ix_puppies_shelter_age', 'shelter_id', 'dateOfBirth', 'id'),
+    )
 
 class Profile(Base):
     __tablename__ = 'profiles'
     id = Column(Integer, primary_key=True)
-    puppy_id = Column(Integer, ForeignKey('puppies.id'))
+    puppy_id = Column(Integer, ForeignKey('puppies.id'), unique=True)
+    puppy = relationship(Puppy, back_populates="profile")
     picture = Column(String)
     description = Column(String)
     special_needs = Column(String)
@@ -51,7 +64,44 @@ class Adopter(Base):
     __tablename__ = 'adopters'
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
+    puppies = relationship(Puppy, secondary=adopt_puppy,
+                           back_populates="adopters")
+
+# Triggers keep Shelter.current_occupancy in step with the puppies in
+# each shelter, in the same transaction as the insert, adoption,
+# transfer or delete; this covers ORM and bulk SQL statements alike.
+# They are created with IF NOT EXISTS, so existing databases get them
+# too.
+occupancy_ddl = [
+    """CREATE TRIGGER IF NOT EXISTS puppy_inserted
+       AFTER INSERT ON puppies WHEN NEW.shelter_id IS NOT NULL
+       BEGIN
+           UPDATE shelter SET current_occupancy = coalesce(current_occupancy, 0) + 1
+           WHERE id = NEW.shelter_id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS puppy_deleted
+       AFTER DELETE ON puppies WHEN OLD.shelter_id IS NOT NULL
+       BEGIN
+           UPDATE shelter SET current_occupancy = coalesce(current_occupancy, 0) - 1
+           WHERE id = OLD.shelter_id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS puppy_moved
+       AFTER UPDATE OF shelter_id ON puppies
+       WHEN OLD.shelter_id IS NOT NEW.shelter_id
+       BEGIN
+           UPDATE shelter SET current_occupancy = coalesce(current_occupancy, 0) - 1
+           WHERE id = OLD.shelter_id;
+           UPDATE shelter SET current_occupancy = coalesce(current_occupancy, 0) + 1
+           WHERE id = NEW.shelter_id;
+       END""",
+]
+
+def install_occupancy_triggers(engine):
+    with engine.begin() as connection:
+        for statement in occupancy_ddl:
+            connection.execute(statement)
 
 engine = create_engine('sqlite:///puppyshelter.db')
 
 Base.metadata.create_all(engine)
+install_occupancy_triggers(engine)
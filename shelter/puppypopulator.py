@@ -1,37 +1,39 @@
-from sqlalchemy import create_engine
+# Fills the puppy shelter database with synthetic data
+#
+# Usage: python puppypopulator.py [number of puppies] [seed]
+#
+# Puppies, their profiles and the adopters are generated lazily and
+# inserted with executemany, CHUNK_SIZE rows per transaction, so a
+# million puppies take minutes rather than hours. Puppy ids are
+# allocated here (from the current max id), so profiles are linked to
+# the right puppy even when the table isn't empty. The same seed (and
+# day) gives the same data.
+import datetime
+import itertools
+import math
+import random
+import sys
+
+from sqlalchemy import create_engine, func, select
 from sqlalchemy.orm import sessionmaker
- 
+
 from puppies import Base, Shelter, Puppy, Profile, Adopter
 #from flask.ext.sqlalchemy import SQLAlchemy
-from random import randint
-import datetime
-import random
 
 engine = create_engine('sqlite:///puppyshelter.db')
 
 Base.metadata.bind = engine
- 
-DBSession = sessionmaker(bind=engine)
-
-session = DBSession()
 
-# Add Shelters
-shelter1 = Shelter(name = "Oakland Animal Services", address = "1101 29th Ave", city = "Oakland", state = "California", zipCode = "94601", website = "oaklandanimalservices.org", max_capacity = 40, current_occupancy = 20)
-session.add(shelter1)
-
-shelter2 = Shelter(name = "San Francisco SPCA Mission Adoption Center", address="250 Florida St", city="San Francisco", state="California", zipCode = "94103", website = "sfspca.org", max_capacity = 40, current_occupancy = 20)
-session.add(shelter2)
-
-shelter3 = Shelter(name = "Wonder Dog Rescue", address= "2926 16th Street", city = "San Francisco", state = "California" , zipCode = "94103", website = "http://wonderdogrescue.org", max_capacity = 40, current_occupancy = 20)
-session.add(shelter3)
-
-shelter4 = Shelter(name = "Humane Society of Alameda", address = "PO Box 1571" ,city = "Alameda" ,state = "California", zipCode = "94501", website = "hsalameda.org", max_capacity = 40, current_occupancy = 20)
-session.add(shelter4)
+DBSession = sessionmaker(bind=engine)
 
-shelter5 = Shelter(name = "Palo Alto Humane Society" ,address = "1149 Chestnut St." ,city = "Menlo Park", state = "California" ,zipCode = "94025", website = "paloaltohumane.org", max_capacity = 40, current_occupancy = 20)
-session.add(shelter5)
+# Rows inserted per transaction
+CHUNK_SIZE = 10000
+SEED = 0
+# Shelters hold at least this many puppies, and are sized for the
+# puppies generated plus this much room for new ones
+MIN_CAPACITY = 40
+SPARE_ROOM = 0.25
 
-# Add Puppies
 male_names = ["Bailey", "Max", "Charlie", "Buddy","Rocky","Jake", "Jack", "Toby", "Cody", "Buster", "Duke", "Cooper", "Riley", "Harley", "Bear", "Tucker", "Murphy", "Lucky", "Oliver", "Sam", "Oscar", "Teddy", "Winston", "Sammy", "Rusty", "Shadow", "Gizmo", "Bentley", "Zeus", "Jackson", "Baxter", "Bandit", "Gus", "Samson", "Milo", "Rudy", "Louie", "Hunter", "Casey", "Rocco", "Sparky", "Joey", "Bruno", "Beau", "Dakota", "Maximus", "Romeo", "Boomer", "Luke", "Henry"]
 
 female_names = ['Bella', 'Lucy', 'Molly', 'Daisy', 'Maggie', 'Sophie', 'Sadie', 'Chloe', 'Bailey', 'Lola', 'Zoe', 'Abby', 'Ginger', 'Roxy', 'Gracie', 'Coco', 'Sasha', 'Lily', 'Angel', 'Princess','Emma', 'Annie', 'Rosie', 'Ruby', 'Lady', 'Missy', 'Lilly', 'Mia', 'Katie', 'Zoey', 'Madison', 'Stella', 'Penny', 'Belle', 'Casey', 'Samantha', 'Holly', 'Lexi', 'Lulu', 'Brandy', 'Jasmine', 'Shelby', 'Sandy', 'Roxie', 'Pepper', 'Heidi', 'Luna', 'Dixie', 'Honey', 'Dakota']
@@ -49,33 +51,92 @@ number_of_males = len(male_names)
 number_of_females = len(female_names)
 number_of_puppies = number_of_males+number_of_females
 
-# This method will make a random age for each puppy between 0-18 months(approx.) old from the day the algorithm was run.
-def CreateRandomAge():
-	today = datetime.date.today()
-	days_old = randint(0,540)
+# This method will make a random age for each puppy between 0-18 months(approx.) old from the given day.
+def CreateRandomAge(rand, today):
+	days_old = rand.randint(0,540)
 	birthday = today - datetime.timedelta(days = days_old)
 	return birthday
 
 # This method will create a random weight between 1.0-40.0 pounds (or whatever unit of measure you prefer)
-def CreateRandomWeight():
-	return random.uniform(1.0, 40.0)
+# rounded to the two decimals Puppy.weight keeps
+def CreateRandomWeight(rand):
+	return round(rand.uniform(1.0, 40.0), 2)
 
-for i,x in enumerate(male_names):
-	new_puppy = Puppy(name = x, gender = "male", dateOfBirth = CreateRandomAge(),picture=random.choice(puppy_images) ,shelter_id=randint(1,5), weight= CreateRandomWeight())
-	session.add(new_puppy)
-	session.commit()
+# Add Shelters that take up to capacity puppies each; returns their ids
+def AddShelters(session, capacity):
+	shelter1 = Shelter(name = "Oakland Animal Services", address = "1101 29th Ave", city = "Oakland", state = "California", zipCode = "94601", website = "oaklandanimalservices.org", max_capacity = capacity, current_occupancy = 0)
+	session.add(shelter1)
 
-for i,x in enumerate(female_names):
-	new_puppy = Puppy(name = x, gender = "female", dateOfBirth = CreateRandomAge(),picture=random.choice(puppy_images),shelter_id=randint(1,5), weight= CreateRandomWeight())
-	session.add(new_puppy)
-	session.commit()
+	shelter2 = Shelter(name = "San Francisco SPCA Mission Adoption Center", address="250 Florida St", city="San Francisco", state="California", zipCode = "94103", website = "sfspca.org", max_capacity = capacity, current_occupancy = 0)
+	session.add(shelter2)
 
-for i in range(1, number_of_puppies+1):
-	new_description = Profile(puppy_id = i, picture = random.choice(puppy_images), description = random.choice(puppy_descriptions), special_needs = random.choice(puppy_special_needs))
-	session.add(new_description)
-	session.commit()
+	shelter3 = Shelter(name = "Wonder Dog Rescue", address= "2926 16th Street", city = "San Francisco", state = "California" , zipCode = "94103", website = "http://wonderdogrescue.org", max_capacity = capacity, current_occupancy = 0)
+	session.add(shelter3)
+
+	shelter4 = Shelter(name = "Humane Society of Alameda", address = "PO Box 1571" ,city = "Alameda" ,state = "California", zipCode = "94501", website = "hsalameda.org", max_capacity = capacity, current_occupancy = 0)
+	session.add(shelter4)
 
-for i,x in enumerate(adopters_name):
-	new_adopter = Adopter(name = x)
-	session.add(new_adopter)
+	shelter5 = Shelter(name = "Palo Alto Humane Society" ,address = "1149 Chestnut St." ,city = "Menlo Park", state = "California" ,zipCode = "94025", website = "paloaltohumane.org", max_capacity = capacity, current_occupancy = 0)
+	session.add(shelter5)
 	session.commit()
+	return [shelter1.id, shelter2.id, shelter3.id, shelter4.id, shelter5.id]
+
+# First free id of a table
+def NextId(table):
+	return (engine.execute(select([func.max(table.c.id)])).scalar() or 0) + 1
+
+# Yields a (puppy, profile) pair of rows per puppy, with puppy ids
+# counting up from first_id
+# Puppies go to random shelters that still have room
+def GeneratePuppies(rand, count, first_id, shelter_ids, capacity, today):
+	spare = dict((shelter_id, capacity) for shelter_id in shelter_ids)
+	open_ids = list(shelter_ids)
+	for puppy_id in xrange(first_id, first_id + count):
+		shelter_id = rand.choice(open_ids)
+		spare[shelter_id] -= 1
+		if not spare[shelter_id]:
+			open_ids.remove(shelter_id)
+		gender = rand.choice(["male", "female"])
+		name = rand.choice(male_names if gender == "male" else female_names)
+		puppy = dict(id = puppy_id, name = name, gender = gender, dateOfBirth = CreateRandomAge(rand, today), picture = rand.choice(puppy_images), shelter_id = shelter_id, weight = CreateRandomWeight(rand))
+		profile = dict(puppy_id = puppy_id, picture = rand.choice(puppy_images), description = rand.choice(puppy_descriptions), special_needs = rand.choice(puppy_special_needs))
+		yield puppy, profile
+
+# Yields the adopters' rows: the names above first, then random ones
+def GenerateAdopters(rand, count):
+	for i in xrange(count):
+		if i < len(adopters_name):
+			yield dict(name = adopters_name[i])
+		else:
+			yield dict(name = rand.choice(adopters_name[1:]))
+
+# Splits rows into lists of CHUNK_SIZE rows
+def Chunks(rows):
+	rows = iter(rows)
+	while True:
+		chunk = list(itertools.islice(rows, CHUNK_SIZE))
+		if not chunk:
+			return
+		yield chunk
+
+def Populate(count = number_of_puppies, seed = SEED, today = None):
+	rand = random.Random(seed)
+	today = today or datetime.date.today()
+	# the puppies are shared by the five shelters
+	capacity = max(MIN_CAPACITY, int(math.ceil(count * (1 + SPARE_ROOM) / 5)))
+	shelter_ids = AddShelters(DBSession(), capacity)
+
+	puppies = GeneratePuppies(rand, count, NextId(Puppy.__table__), shelter_ids, capacity, today)
+	for chunk in Chunks(puppies):
+		with engine.begin() as connection:
+			connection.execute(Puppy.__table__.insert(), [puppy for puppy, profile in chunk])
+			connection.execute(Profile.__table__.insert(), [profile for puppy, profile in chunk])
+
+	adopters = GenerateAdopters(rand, max(len(adopters_name), count // 10))
+	for chunk in Chunks(adopters):
+		with engine.begin() as connection:
+			connection.execute(Adopter.__table__.insert(), chunk)
+
+if __name__ == '__main__':
+	Populate(int(sys.argv[1]) if len(sys.argv) > 1 else number_of_puppies,
+		int(sys.argv[2]) if len(sys.argv) > 2 else SEED)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+#
+# Test cases for the shelter models, catalog.py, shelterservice.py and
+# placement.py
+#
+# Every test runs against a fresh database in a temporary directory.
+
+import datetime
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from puppies import Base, Shelter, Puppy, Profile, Adopter
+from puppies import install_occupancy_triggers
+from catalog import ListPuppies, ListAdopters, SearchPuppies
+from shelterservice import AdoptPuppies, TransferPuppies, ReconcileOccupancy
+from placement import PlacePuppies
+
+directory = tempfile.mkdtemp()
+engine = create_engine('sqlite:///' + os.path.join(directory, 'test.db'))
+DBSession = sessionmaker(bind = engine)
+
+# (statement, parameters) of the queries run
+queries = []
+
+@event.listens_for(engine, "before_cursor_execute")
+def countQuery(conn, cursor, statement, parameters, context, executemany):
+    queries.append((statement, parameters))
+
+def newDatabase():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    install_occupancy_triggers(engine)
+    return DBSession()
+
+def addPuppies(session, number):
+    shelters = [Shelter(name = "Shelter %s" % i, max_capacity = number)
+                for i in range(3)]
+    session.add_all(shelters)
+    for i in range(number):
+        puppy = Puppy(name = "Puppy %s" % i, gender = "female",
+                      shelter = shelters[i % 3])
+        puppy.profile = Profile(description = "Puppy number %s" % i)
+        session.add(puppy)
+    adopters = [Adopter(name = "Adopter %s" % i) for i in range(2)]
+    session.add_all(adopters)
+    session.commit()
+    return shelters, adopters
+
+def countQueries(function, *args):
+    del queries[:]
+    function(*args)
+    return len(queries)
+
+def showPuppies(session):
+    for puppy in ListPuppies(session):
+        puppy.shelter and puppy.shelter.name
+        puppy.profile.description
+        [adopter.name for adopter in puppy.adopters]
+
+def testProfile():
+    session = newDatabase()
+    addPuppies(session, 1)
+    puppy = session.query(Puppy).one()
+    if puppy.profile.puppy is not puppy:
+        raise ValueError("A profile should belong to its puppy.")
+    print "1. A puppy has one profile, which links back to it."
+
+def testAdoption():
+    session = newDatabase()
+    shelters, adopters = addPuppies(session, 3)
+    puppy = session.query(Puppy).order_by(Puppy.id).first()
+    adopted = AdoptPuppies(session, [(puppy.id, [a.id for a in adopters])])
+    if adopted != 1:
+        raise ValueError("AdoptPuppies() should return 1, not %s." % adopted)
+    session.expire_all()
+    if set(puppy.adopters) != set(adopters):
+        raise ValueError("Both adopters should be in puppy.adopters.")
+    if adopters[0].puppies != [puppy]:
+        raise ValueError("The puppy should be in adopter.puppies.")
+    if puppy.shelter_id is not None:
+        raise ValueError("An adopted puppy should leave its shelter.")
+    if shelters[0].current_occupancy != 0:
+        raise ValueError("The shelter should have no puppies left.")
+    if AdoptPuppies(session, [(puppy.id, [adopters[0].id])]) != 0:
+        raise ValueError("A puppy can't be adopted twice.")
+    print "2. Puppies can be adopted by several adopters."
+
+def testAdoptionInput():
+    session = newDatabase()
+    shelters, adopters = addPuppies(session, 3)
+    first, second, third = session.query(Puppy).order_by(Puppy.id).all()
+    adopter_id = adopters[0].id
+    adopted = AdoptPuppies(session, [(first.id, [adopter_id, adopter_id]),
+                                     (second.id, [])])
+    if adopted != 1:
+        raise ValueError("AdoptPuppies() should return 1, not %s." % adopted)
+    session.expire_all()
+    if first.adopters != [adopters[0]] or first.shelter_id is not None:
+        raise ValueError("An adopter listed twice should adopt the puppy once.")
+    if second.adopters or second.shelter_id is None:
+        raise ValueError("A puppy without adopters should stay in its shelter.")
+    if AdoptPuppies(session, [(third.id, [])]) != 0:
+        raise ValueError("A puppy without adopters shouldn't be adopted.")
+    print "10. Repeated adopters are adopted once, and no adopters is no adoption."
+
+def testListPuppies():
+    session = newDatabase()
+    shelters, adopters = addPuppies(session, 10)
+    AdoptPuppies(session, [(puppy_id, [a.id for a in adopters])
+                           for puppy_id in range(1, 6)])
+    session.close()
+    few = countQueries(showPuppies, DBSession())
+    if few != 2:
+        raise ValueError(
+            "Listing puppies should take 2 queries, not %s." % few)
+    session = DBSession()
+    shelters, adopters = addPuppies(session, 200)
+    AdoptPuppies(session, [(puppy_id, [a.id for a in adopters])
+                           for puppy_id in range(6, 200)])
+    session.close()
+    many = countQueries(showPuppies, DBSession())
+    if many != few:
+        raise ValueError(
+            "Listing 210 puppies took %s queries, 10 puppies %s." % (many, few))
+    print "3. Puppies are listed with their shelter, profile and adopters in 2 queries."
+
+def testListAdopters():
+    session = newDatabase()
+    shelters, adopters = addPuppies(session, 20)
+    AdoptPuppies(session, [(puppy_id, [a.id for a in adopters])
+                           for puppy_id in range(1, 21)])
+    session.close()
+    def showAdopters(session):
+        for adopter in ListAdopters(session):
+            [puppy.profile.description for puppy in adopter.puppies]
+    count = countQueries(showAdopters, DBSession())
+    if count != 2:
+        raise ValueError(
+            "Listing adopters should take 2 queries, not %s." % count)
+    print "4. Adopters are listed with their puppies in 2 queries."
+
+today = datetime.date(2015, 6, 1)
+
+def addSearchPuppies(session):
+    shelters = [Shelter(name = "Shelter %s" % i) for i in range(2)]
+    session.add_all(shelters)
+    for i in range(30):
+        puppy = Puppy(name = "Puppy %s" % i,
+                      gender = ["male", "female"][i % 2],
+                      dateOfBirth = today - datetime.timedelta(days = i * 10),
+                      weight = 1 + (i % 7) * 2.5, shelter = shelters[i % 2])
+        puppy.profile = Profile(special_needs = ["None", "Likes bananas"][i % 3 == 0])
+        session.add(puppy)
+    session.commit()
+    return shelters
+
+def searchAll(session, **kwargs):
+    puppies, after = SearchPuppies(session, limit = 4, today = today, **kwargs)
+    pages = 1
+    while after is not None:
+        page, after = SearchPuppies(session, limit = 4, today = today,
+                                    after = after, **kwargs)
+        puppies.extend(page)
+        pages += 1
+    return [puppy.name for puppy in puppies], pages
+
+def testSearchPuppies():
+    session = newDatabase()
+    shelters = addSearchPuppies(session)
+    names, pages = searchAll(session)
+    if names != ["Puppy %s" % i for i in range(30)] or pages != 8:
+        raise ValueError("All puppies should be found, youngest first, 4 a page.")
+    names, pages = searchAll(session, min_age = 50, max_age = 100,
+                             gender = "male")
+    if names != ["Puppy 6", "Puppy 8"]:
+        raise ValueError("Age and gender filters returned %s." % names)
+    names, pages = searchAll(session, shelter_id = shelters[1].id,
+                             special_needs = "Likes bananas")
+    if names != ["Puppy 3", "Puppy 9", "Puppy 15", "Puppy 21", "Puppy 27"]:
+        raise ValueError("Shelter and special needs filters returned %s." % names)
+    session.close()
+    names, pages = searchAll(DBSession(), order = "lightest", max_weight = 3.5)
+    expected = ["Puppy %s" % i for i in range(30) if i % 7 == 0] + \
+               ["Puppy %s" % i for i in range(30) if i % 7 == 1]
+    if names != expected:
+        raise ValueError("Puppies up to 3.5 by weight should be %s, not %s." %
+                         (expected, names))
+    print "5. Puppies can be searched and paged through by age and weight."
+
+def testSearchIndexes():
+    session = newDatabase()
+    addSearchPuppies(session)
+    for kwargs, index in [({}, "ix_puppies_age"),
+                          ({"order": "heaviest"}, "ix_puppies_weight"),
+                          ({"gender": "male"}, "ix_puppies_gender_age"),
+                          ({"shelter_id": 1}, "ix_puppies_shelter_age")]:
+        del queries[:]
+        SearchPuppies(session, limit = 4, today = today, **kwargs)
+        statement, parameters = queries[0]
+        plan = " ".join(str(row) for row in engine.execute(
+            "EXPLAIN QUERY PLAN " + statement, parameters))
+        if index not in plan:
+            raise ValueError("Searching with %s should use %s: %s" %
+                             (kwargs, index, plan))
+    print "6. Searches use the puppy indexes."
+
+def occupancy(session):
+    session.expire_all()
+    return [shelter.current_occupancy for shelter in
+            session.query(Shelter).order_by(Shelter.id)]
+
+def testOccupancyTriggers():
+    session = newDatabase()
+    shelters, adopters = addPuppies(session, 6)
+    if occupancy(session) != [2, 2, 2]:
+        raise ValueError("Inserting puppies should count them, not %s." %
+                         occupancy(session))
+    puppy = session.query(Puppy).order_by(Puppy.id).first()
+    puppy.shelter = shelters[1]
+    session.commit()
+    if occupancy(session) != [1, 3, 2]:
+        raise ValueError("Moving a puppy should move its count, not %s." %
+                         occupancy(session))
+    session.delete(puppy.profile)
+    session.delete(puppy)
+    session.commit()
+    if occupancy(session) != [1, 2, 2]:
+        raise ValueError("Deleting a puppy should uncount it, not %s." %
+                         occupancy(session))
+    session.execute(Puppy.__table__.update().
+                    where(Puppy.shelter_id == shelters[2].id).
+                    values(shelter_id = None))
+    session.commit()
+    if occupancy(session) != [1, 2, 0]:
+        raise ValueError("A bulk update should be counted, not %s." %
+                         occupancy(session))
+    print "7. Triggers keep current_occupancy up to date."
+
+def testTransferPuppies():
+    session = newDatabase()
+    shelters, adopters = addPuppies(session, 6)
+    from_first = [puppy.id for puppy in session.query(Puppy).
+                  filter(Puppy.shelter_id == shelters[0].id)]
+    transferred = TransferPuppies(session, from_first, shelters[1].id)
+    if transferred != 2:
+        raise ValueError("TransferPuppies() should return 2, not %s." %
+                         transferred)
+    if occupancy(session) != [0, 4, 2]:
+        raise ValueError("Transferred puppies should be counted, not %s." %
+                         occupancy(session))
+    session.execute(Shelter.__table__.update().
+                    where(Shelter.id == shelters[2].id).
+                    values(max_capacity = 3))
+    session.commit()
+    try:
+        TransferPuppies(session, from_first, shelters[2].id)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A shelter shouldn't take more puppies than it fits.")
+    if occupancy(session) != [0, 4, 2]:
+        raise ValueError("A refused transfer shouldn't move puppies, not %s." %
+                         occupancy(session))
+    print "8. Puppies can be transferred to shelters that have room."
+
+def testReconcileOccupancy():
+    session = newDatabase()
+    shelters, adopters = addPuppies(session, 6)
+    session.execute(Shelter.__table__.update().
+                    where(Shelter.id == shelters[0].id).
+                    values(current_occupancy = 40))
+    session.commit()
+    fixed = ReconcileOccupancy(session)
+    if fixed != 1:
+        raise ValueError("ReconcileOccupancy() should fix 1 shelter, not %s." %
+                         fixed)
+    if occupancy(session) != [2, 2, 2]:
+        raise ValueError("The corrupted count should be fixed, not %s." %
+                         occupancy(session))
+    if ReconcileOccupancy(session) != 0:
+        raise ValueError("There should be nothing left to fix.")
+    print "9. ReconcileOccupancy() fixes corrupted counts."
+
+def newPuppies(number):
+    return [Puppy(name = "New puppy %s" % i, gender = "male")
+            for i in range(number)]
+
+def testPlacementSkipsFullShelter():
+    session = newDatabase()
+    shelters = [Shelter(name = "Full", max_capacity = 2),
+                Shelter(name = "Roomy", max_capacity = 5)]
+    session.add_all(shelters)
+    session.add_all([Puppy(name = "Puppy %s" % i, gender = "female",
+                           shelter = shelters[0]) for i in range(2)])
+    session.commit()
+    shelter_ids = PlacePuppies(session, newPuppies(3))
+    if shelter_ids != [shelters[1].id] * 3:
+        raise ValueError("The full shelter should be skipped, not %s." %
+                         shelter_ids)
+    if occupancy(session) != [2, 3]:
+        raise ValueError("Placed puppies should be counted, not %s." %
+                         occupancy(session))
+    print "11. PlacePuppies() skips full shelters."
+
+def testPlacementNearestZip():
+    session = newDatabase()
+    shelters = [Shelter(name = "Far", max_capacity = 1, zipCode = "10001"),
+                Shelter(name = "Near", max_capacity = 1, zipCode = "94103"),
+                Shelter(name = "Nearby", max_capacity = 1, zipCode = "94301"),
+                Shelter(name = "Unknown", max_capacity = 1)]
+    session.add_all(shelters)
+    session.commit()
+    shelter_ids = PlacePuppies(session, newPuppies(4), zipCode = "94110")
+    expected = [shelters[i].id for i in (1, 2, 0, 3)]
+    if shelter_ids != expected:
+        raise ValueError("Shelters should be filled nearest first: %s, not %s." %
+                         (expected, shelter_ids))
+    print "12. PlacePuppies() tries the shelters nearest to the zip code first."
+
+def testPlacementNoRoom():
+    session = newDatabase()
+    session.add_all([Shelter(name = "Small %s" % i, max_capacity = 1)
+                     for i in range(2)])
+    session.commit()
+    before = occupancy(session)
+    puppies = newPuppies(3)
+    try:
+        PlacePuppies(session, puppies)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("3 puppies shouldn't fit in 2 places.")
+    if session.new or any(puppy.shelter_id for puppy in puppies):
+        raise ValueError("No puppy should be placed when they don't all fit.")
+    if session.query(Puppy).count() != 0 or occupancy(session) != before:
+        raise ValueError("No puppy should be stored when they don't all fit.")
+    print "13. PlacePuppies() raises ValueError and places nothing when there's no room."
+
+if __name__ == '__main__':
+    try:
+        testProfile()
+        testAdoption()
+        testListPuppies()
+        testListAdopters()
+        testSearchPuppies()
+        testSearchIndexes()
+        testOccupancyTriggers()
+        testTransferPuppies()
+        testReconcileOccupancy()
+        testAdoptionInput()
+        testPlacementSkipsFullShelter()
+        testPlacementNearestZip()
+        testPlacementNoRoom()
+    finally:
+        shutil.rmtree(directory)
+    print "Success!  All tests pass!"
@@ -0,0 +1,106 @@
+# Bulk operations on the shelter database
+#
+# Every operation runs as a few set-based statements (no per-puppy
+# queries or commits) inside one transaction. The triggers created in
+# puppies.py keep Shelter.current_occupancy in step with the puppies
+# they move.
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import sessionmaker
+from puppies import engine, Shelter, Puppy, adopt_puppy
+
+# SQLite allows at most 999 bound parameters per statement
+CHUNK_SIZE = 500
+
+shelters = Shelter.__table__
+puppies = Puppy.__table__
+
+def Chunks(ids):
+	ids = list(ids)
+	for i in range(0, len(ids), CHUNK_SIZE):
+		yield ids[i:i + CHUNK_SIZE]
+
+# Move the puppies (ids) that are in a shelter other than to_shelter_id
+# out of their shelters (into to_shelter_id)
+def MovePuppies(session, ids, to_shelter_id):
+	moved = 0
+	for chunk in Chunks(ids):
+		leaving = and_(puppies.c.id.in_(chunk), puppies.c.shelter_id != None)
+		if to_shelter_id is not None:
+			leaving = and_(leaving, puppies.c.shelter_id != to_shelter_id)
+		moved += session.execute(puppies.update().where(leaving).
+			values(shelter_id = to_shelter_id)).rowcount
+	return moved
+
+# Adopt puppies in bulk
+# Takes a list of (puppy id, list of adopter ids) pairs
+# Puppies that are not in a shelter (already adopted) or have no
+# adopters are skipped; an adopter listed twice adopts the puppy once
+# Returns the number of puppies adopted
+def AdoptPuppies(session, adoptions):
+	adoptions = dict((puppy_id, sorted(set(adopter_ids)))
+		for puppy_id, adopter_ids in adoptions if adopter_ids)
+	try:
+		# Only puppies that are still in a shelter can be adopted
+		in_shelter = []
+		for chunk in Chunks(adoptions):
+			in_shelter.extend(row[0] for row in session.execute(
+				select([puppies.c.id]).where(and_(puppies.c.id.in_(chunk),
+					puppies.c.shelter_id != None))))
+		rows = [{'puppy_id': puppy_id, 'adopter_id': adopter_id}
+			for puppy_id in in_shelter for adopter_id in adoptions[puppy_id]]
+		if rows:
+			session.execute(adopt_puppy.insert(), rows)
+		adopted = MovePuppies(session, in_shelter, None)
+		session.commit()
+	except:
+		session.rollback()
+		raise
+	return adopted
+
+# Transfer puppies in bulk to another shelter
+# Puppies that are adopted or already in that shelter are skipped
+# Raises ValueError if the shelter can't take them all
+# Returns the number of puppies transferred
+def TransferPuppies(session, puppy_ids, shelter_id):
+	try:
+		shelter = session.execute(select([shelters.c.max_capacity,
+			func.coalesce(shelters.c.current_occupancy, 0)]).
+			where(shelters.c.id == shelter_id)).first()
+		if shelter is None:
+			raise ValueError("There is no shelter with id %s" % shelter_id)
+		moving = 0
+		for chunk in Chunks(puppy_ids):
+			moving += session.execute(select([func.count()]).where(and_(
+				puppies.c.id.in_(chunk), puppies.c.shelter_id != None,
+				puppies.c.shelter_id != shelter_id))).scalar()
+		max_capacity, occupancy = shelter
+		if max_capacity is not None and occupancy + moving > max_capacity:
+			raise ValueError("Shelter %s has room for %s puppies, not %s" %
+				(shelter_id, max_capacity - occupancy, moving))
+		transferred = MovePuppies(session, puppy_ids, shelter_id)
+		session.commit()
+	except:
+		session.rollback()
+		raise
+	return transferred
+
+# Fix shelters whose current_occupancy drifted from the number of
+# puppies in them (e.g. rows changed before the triggers existed), in
+# a single UPDATE
+# Returns the number of shelters fixed
+def ReconcileOccupancy(session):
+	count = select([func.count()]).where(
+		puppies.c.shelter_id == shelters.c.id).as_scalar()
+	try:
+		fixed = session.execute(shelters.update().
+			where(func.coalesce(shelters.c.current_occupancy, -1) != count).
+			values(current_occupancy = count)).rowcount
+		session.commit()
+	except:
+		session.rollback()
+		raise
+	return fixed
+
+if __name__ == '__main__':
+	session = sessionmaker(bind = engine)()
+	print "Fixed the occupancy of %s shelters" % ReconcileOccupancy(session)